@@ -0,0 +1,83 @@
+"""
+Compare PageGraphicsItem with and without `batch_paths`:
+number of scene items, build time, render time and differing pixels.
+
+Usage: python benchmarks/bench_batching.py [--strokes N] [--points N] [--tools T1,T2,...]
+"""
+import io
+import os
+import time
+import argparse
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import synth
+
+from PyQt5.QtCore import Qt, QRectF
+from PyQt5.QtGui import QImage, QPainter
+
+from remy.remarkable.lines import readLines, Layer
+from remy.remarkable.metadata import Page
+from remy.remarkable.render import BarePageScene
+from remy.remarkable.palette import Palette
+import remy.remarkable.constants as rm
+
+
+def render(scene, scale):
+  img = QImage(int(rm.WIDTH * scale), int(rm.HEIGHT * scale), QImage.Format_ARGB32)
+  img.fill(Qt.white)
+  p = QPainter(img)
+  p.setRenderHint(QPainter.Antialiasing)
+  scene.render(p, QRectF(img.rect()), QRectF(0, 0, rm.WIDTH, rm.HEIGHT))
+  p.end()
+  return img
+
+
+def diff(a, b):
+  n = 0
+  ba, bb = a.constBits(), b.constBits()
+  ba.setsize(a.sizeInBytes())
+  bb.setsize(b.sizeInBytes())
+  ba, bb = bytes(ba), bytes(bb)
+  for i in range(0, len(ba), 4):
+    if max(abs(ba[i + c] - bb[i + c]) for c in range(3)) > 32:
+      n += 1
+  return n
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument('--strokes', type=int, default=1000)
+  parser.add_argument('--points', type=int, default=200)
+  parser.add_argument('--tools', default=",".join(synth.DEFAULT_TOOLS))
+  parser.add_argument('--scale', type=float, default=.5, help="of the rendered image")
+  parser.add_argument('--repeat', type=int, default=3)
+  args = parser.parse_args()
+
+  synth.qapp()
+  data = synth.synthPage(strokes=args.strokes, points=args.points, tools=args.tools.split(','))
+  ver, layers = readLines(io.BytesIO(data))
+  page = Page([Layer(l, "Layer %d" % (i + 1), []) for i, l in enumerate(layers)], ver, 0, None)
+  print("page: %d strokes x %d points, tools %s" % (args.strokes, args.points, args.tools))
+
+  images = []
+  for batch in (False, True):
+    options = {"palette": Palette(), "batch_paths": batch}
+    build = draw = float('inf')
+    for _ in range(args.repeat):
+      t = time.perf_counter()
+      scene = BarePageScene(page, **options)
+      build = min(build, time.perf_counter() - t)
+      t = time.perf_counter()
+      img = render(scene, args.scale)
+      draw = min(draw, time.perf_counter() - t)
+    images.append(img)
+    print("batch_paths=%-5s %7d items  build %7.3fs  render %7.3fs"
+          % (batch, len(scene.items()), build, draw))
+  d = diff(*images)
+  print("pixels differing noticeably: %d (%.3f%%)"
+        % (d, 100 * d / (images[0].width() * images[0].height())))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,70 @@
+"""
+Render an eraser-heavy synthetic page with each eraser mode:
+build time, render time, and how many clips the accurate erasers produce.
+
+Usage: python benchmarks/bench_eraser.py [--strokes N] [--points N] [--erasers FRACTION]
+"""
+import io
+import os
+import time
+import argparse
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import synth
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage, QPainter
+
+from remy.remarkable.lines import readLines, Layer
+from remy.remarkable.metadata import Page
+from remy.remarkable.render import BarePageScene, PagePainter, pageOps, OP_ERASE
+from remy.remarkable.palette import Palette
+import remy.remarkable.constants as rm
+
+
+def render(scene, scale):
+  img = QImage(int(rm.WIDTH * scale), int(rm.HEIGHT * scale), QImage.Format_ARGB32)
+  img.fill(Qt.white)
+  p = QPainter(img)
+  p.setRenderHint(QPainter.Antialiasing)
+  scene.render(p)
+  p.end()
+  return img
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument('--strokes', type=int, default=600)
+  parser.add_argument('--points', type=int, default=100)
+  parser.add_argument('--erasers', type=float, default=.5, help="fraction of eraser strokes")
+  parser.add_argument('--scale', type=float, default=.5, help="of the rendered image")
+  parser.add_argument('--repeat', type=int, default=3)
+  args = parser.parse_args()
+
+  synth.qapp()
+  n = max(1, round(args.erasers * 10))
+  tools = ["eraser"] * n + ["brush", "ballpoint", "marker", "pencil", "highlighter"][:10 - n]
+  data = synth.synthPage(strokes=args.strokes, points=args.points, tools=tools)
+  ver, layers = readLines(io.BytesIO(data))
+  page = Page([Layer(l, "Layer %d" % (i + 1), []) for i, l in enumerate(layers)], ver, 0, None)
+  erasers = sum(1 for l in page.layers for k in l.strokes if k.pen == 6)
+  print("page: %d strokes (%d erasers) x %d points" % (args.strokes, erasers, args.points))
+
+  for mode in ("ignore", "quick", "accurate"):
+    options = {"palette": Palette(), "eraser_mode": mode}
+    clips = sum(1 for op in pageOps(page, **options) if op[0] == OP_ERASE)
+    for name, build in (("scene", BarePageScene), ("painter", PagePainter)):
+      tb = tr = float('inf')
+      for _ in range(args.repeat):
+        t = time.perf_counter()
+        scene = build(page, **options)
+        tb = min(tb, time.perf_counter() - t)
+        t = time.perf_counter()
+        render(scene, args.scale)
+        tr = min(tr, time.perf_counter() - t)
+      print("%-8s %-7s build %7.3fs  render %7.3fs  clips %d" % (mode, name, tb, tr, clips))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,100 @@
+"""
+Time and peak memory (max RSS) of exporting an annotated PDF against its
+number of pages, with the PyMuPDF pipeline and with the PyPDF2 one.
+Each export runs in a process of its own, so that the peak memory of one
+does not hide the next; the time and memory taken to synthesise the
+document are not counted.
+
+With --marked only that many pages are annotated, as in a lightly
+annotated book, and the other pages are copied from the base PDF.
+
+Usage: python benchmarks/bench_export.py [--pages N,N,...] [--marked N] [--engines mupdf,pypdf2] [--strokes N] [--points N] [--workers N]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+
+def maxrss():
+  r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return r / 2**20 if sys.platform == 'darwin' else r / 2**10
+
+
+def export(args):
+  import synth
+  from remy.remarkable.filesource import LocalFileSource
+  from remy.remarkable.metadata import RemarkableIndex
+  from remy.remarkable.palette import Palette
+  from remy.remarkable import export
+
+  synth.qapp()
+  if args.engines == 'pypdf2':
+    export.fitz = None
+  tmp = tempfile.mkdtemp(prefix='remy-bench-')
+  try:
+    root = os.path.join(tmp, 'xochitl')
+    synth.writeDocument(root, 'bench', pages=args.pages, pdf=True, marked=args.marked,
+                        strokes=args.strokes, points=args.points)
+    doc = RemarkableIndex(LocalFileSource('bench', root)).get('bench')
+    output = os.path.join(tmp, 'exported.pdf')
+    exporter = export.Exporter(output, doc, palette=Palette(), workers=args.workers)
+    errors = []
+    exporter.onError.connect(errors.append)
+    before = maxrss()
+    t = time.perf_counter()
+    exporter.run() # in this thread
+    t = time.perf_counter() - t
+    del exporter
+    if errors:
+      raise errors[0]
+    return {
+      "seconds": t,
+      "maxrss_mb": maxrss(),
+      "before_mb": before,
+      "output_mb": os.path.getsize(output) / 2**20,
+    }
+  finally:
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument('--pages', default="50,100,200,400")
+  parser.add_argument('--marked', type=int, help="number of annotated pages (default all)")
+  parser.add_argument('--engines', default="mupdf,pypdf2")
+  parser.add_argument('--strokes', type=int, default=100)
+  parser.add_argument('--points', type=int, default=50)
+  parser.add_argument('--workers', type=int, default=0, help="render threads, 0 for one per core")
+  parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.child:
+    args.pages = int(args.pages)
+    json.dump(export(args), sys.stdout)
+    return
+
+  marked = ['--marked', str(args.marked)] if args.marked is not None else []
+  print("%-7s %6s %9s %10s %10s %9s" % ("engine", "pages", "time", "max RSS", "before", "output"))
+  for engine in args.engines.split(','):
+    for pages in args.pages.split(','):
+      out = subprocess.run(
+        [sys.executable, __file__, '--child', '--engines', engine, '--pages', pages,
+         '--strokes', str(args.strokes), '--points', str(args.points),
+         '--workers', str(args.workers)] + marked,
+        check=True, stdout=subprocess.PIPE, universal_newlines=True
+      ).stdout
+      r = json.loads(out.strip().splitlines()[-1])
+      print("%-7s %6s %8.2fs %8.1fMB %8.1fMB %7.1fMB"
+            % (engine, pages, r["seconds"], r["maxrss_mb"], r["before_mb"], r["output_mb"]))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,48 @@
+"""
+Compare the buffer-based `.rm` decoder with the legacy streaming parser
+(v6 pages, which the legacy parser cannot read, are only decoded).
+
+Usage: python benchmarks/bench_lines.py [--strokes N] [--points N] [--repeat N]
+"""
+import io
+import time
+import argparse
+
+import synth
+from remy.remarkable.lines import readLines, readLinesLegacy, np
+
+
+def timeit(fn, data, repeat):
+  best = float('inf')
+  for _ in range(repeat):
+    t = time.perf_counter()
+    fn(io.BytesIO(data))
+    best = min(best, time.perf_counter() - t)
+  return best
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument('--strokes', type=int, default=2000)
+  parser.add_argument('--points', type=int, default=250)
+  parser.add_argument('--version', type=int, default=5, choices=(3, 5, 6))
+  parser.add_argument('--repeat', type=int, default=5)
+  args = parser.parse_args()
+
+  if np is None:
+    print("numpy is not installed: readLines falls back to the legacy parser")
+
+  data = synth.synthPage(version=args.version, strokes=args.strokes, points=args.points)
+  print("page: v%d, %d strokes x %d points, %.1f MB"
+        % (args.version, args.strokes, args.points, len(data) / 2**20))
+  fast = timeit(readLines, data, args.repeat)
+  if args.version == 6:
+    print("readLines %8.4fs" % fast)
+    return
+  legacy = timeit(readLinesLegacy, data, args.repeat)
+  print("legacy   %8.4fs" % legacy)
+  print("readLines %8.4fs  (%.1fx)" % (fast, legacy / fast))
+
+
+if __name__ == '__main__':
+  main()
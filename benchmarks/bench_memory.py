@@ -0,0 +1,63 @@
+"""
+Memory footprint of a decoded page for each segment representation:
+namedtuple per point (legacy parser), interleaved `array('f')` per stroke
+(`CompactSegments`) and numpy views on the file buffer (`Segments`).
+
+Usage: python benchmarks/bench_memory.py [--strokes N] [--points N]
+"""
+import io
+import gc
+import time
+import argparse
+import tracemalloc
+
+import synth
+import remy.remarkable.lines as lines
+
+
+def measure(fn, data):
+  gc.collect()
+  gc_before = sum(s['collections'] for s in gc.get_stats())
+  tracemalloc.start()
+  t = time.perf_counter()
+  # a fresh copy, so that views on the file buffer are accounted for
+  page = fn(io.BytesIO(bytes(bytearray(data))))
+  t = time.perf_counter() - t
+  current, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  gcs = sum(s['collections'] for s in gc.get_stats()) - gc_before
+  del page
+  return current, peak, t, gcs
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument('--strokes', type=int, default=2000)
+  parser.add_argument('--points', type=int, default=250)
+  args = parser.parse_args()
+
+  data = synth.synthPage(strokes=args.strokes, points=args.points)
+  print("page: %d strokes x %d points, file %.1f MB"
+        % (args.strokes, args.points, len(data) / 2**20))
+
+  np = lines.np
+
+  def compact(f):
+    lines.np = None
+    try:
+      return lines.readLines(f)
+    finally:
+      lines.np = np
+
+  variants = [("namedtuple", lines.readLinesLegacy), ("array('f')", compact)]
+  if np is not None:
+    variants.append(("numpy", lines.readLines))
+
+  print("%-12s %10s %10s %8s %6s" % ("layout", "retained", "peak", "time", "GCs"))
+  for name, fn in variants:
+    current, peak, t, gcs = measure(fn, data)
+    print("%-12s %8.1fMB %8.1fMB %7.3fs %6d" % (name, current / 2**20, peak / 2**20, t, gcs))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,180 @@
+"""
+Benchmark the parse -> render -> export pipeline on a synthetic document.
+
+Stages: `parse` (readLines), `items` (PageGraphicsItem), `scenes`
+(BarePageScene), `painters` (PagePainter), `pdf` (scenesPdf of prebuilt
+painters, as the exporter does) and, with --pdf, `merge` (pdfmerge with a
+synthetic base PDF).
+Each stage is timed on its own (best of --repeat runs), then run once more
+under tracemalloc to record its peak Python memory.  Results are printed
+(or written to --output) as JSON, to track pages/sec and MB/page across
+releases.  Runs headless on Qt's offscreen platform.
+
+Usage: python benchmarks/bench_pipeline.py [--pages N] [--strokes N] [--points N] [--pdf] [--output FILE]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import tracemalloc
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import synth
+
+from PyQt5.QtCore import QT_VERSION_STR, PYQT_VERSION_STR
+
+from remy.remarkable.lines import readLines, np
+from remy.remarkable.filesource import LocalFileSource
+from remy.remarkable.metadata import RemarkableIndex
+from remy.remarkable.render import PageGraphicsItem, BarePageScene, PagePainter
+from remy.remarkable.palette import Palette
+from remy.remarkable.export import scenesPdf, pdfmerge
+
+STAGES = ('parse', 'items', 'scenes', 'painters', 'pdf', 'merge')
+
+
+def maxrss():
+  r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return r / 2**20 if sys.platform == 'darwin' else r / 2**10
+
+
+def measure(run, setup, repeat, memory):
+  best = float('inf')
+  for _ in range(repeat):
+    arg = setup()
+    t = time.perf_counter()
+    out = run(arg)
+    best = min(best, time.perf_counter() - t)
+    del out
+  result = {"seconds": best}
+  if memory:
+    arg = setup()
+    tracemalloc.start()
+    out = run(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del out
+    result["py_peak_mb"] = peak / 2**20
+  result["maxrss_mb"] = maxrss()
+  return result
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument('--pages', type=int, default=20)
+  parser.add_argument('--layers', type=int, default=1)
+  parser.add_argument('--strokes', type=int, default=300)
+  parser.add_argument('--points', type=int, default=100)
+  parser.add_argument('--version', type=int, default=5, choices=(3, 5, 6))
+  parser.add_argument('--tools', default=",".join(synth.DEFAULT_TOOLS),
+                      help="comma separated tool names, used in turn")
+  parser.add_argument('--pdf', action='store_true', help="annotate a synthetic base PDF")
+  parser.add_argument('--eraser-mode', default='ignore')
+  parser.add_argument('--simplify', type=float, default=0)
+  parser.add_argument('--smoothen', action='store_true')
+  parser.add_argument('--stages', default=",".join(STAGES))
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--no-memory', dest='memory', action='store_false')
+  parser.add_argument('--output', help="write the JSON results here instead of stdout")
+  args = parser.parse_args()
+
+  synth.qapp()
+  stages = [s for s in args.stages.split(',') if s in STAGES]
+  options = {
+    "palette": Palette().opacityBased(),
+    "eraser_mode": args.eraser_mode,
+    "simplify": args.simplify,
+    "smoothen": args.smoothen,
+  }
+  tmp = tempfile.mkdtemp(prefix='remy-bench-')
+  try:
+    root = os.path.join(tmp, 'xochitl')
+    pids = synth.writeDocument(
+      root, 'bench', pages=args.pages, pdf=args.pdf, version=args.version,
+      layers=args.layers, strokes=args.strokes, points=args.points,
+      tools=args.tools.split(',')
+    )
+    files = [os.path.join(root, 'bench', pid + '.rm') for pid in pids]
+    index = RemarkableIndex(LocalFileSource('bench', root))
+    doc = index.get('bench')
+    pages = [doc.getPage(i) for i in range(args.pages)]
+    annotations = os.path.join(tmp, 'annotations.pdf')
+    merged = os.path.join(tmp, 'merged.pdf')
+
+    def parse(_):
+      for f in files:
+        with open(f, 'rb') as fd:
+          readLines(fd)
+
+    def scenes():
+      return [BarePageScene(p, **options) for p in pages]
+
+    def painters():
+      return [PagePainter(p, **options) for p in pages]
+
+    def pdf(sc):
+      scenesPdf(lambda _: iter(sc), range(len(sc)), annotations)
+
+    def copyAnnotations():
+      if not os.path.exists(annotations):
+        pdf(painters())
+      shutil.copy(annotations, merged)
+
+    runs = {
+      "parse": (parse, lambda: None),
+      "items": (lambda _: [PageGraphicsItem(p, **options) for p in pages], lambda: None),
+      "scenes": (lambda _: scenes(), lambda: None),
+      "painters": (lambda _: painters(), lambda: None),
+      "pdf": (pdf, painters),
+      "merge": (lambda _: pdfmerge(doc.baseDocument(), merged), copyAnnotations),
+    }
+
+    BarePageScene(pages[0], **options) # warm up one-time initialisations
+
+    results = {}
+    for stage in stages:
+      if stage == 'merge' and not args.pdf:
+        continue
+      run, setup = runs[stage]
+      r = measure(run, setup, args.repeat, args.memory)
+      r["pages_per_sec"] = args.pages / r["seconds"] if r["seconds"] else None
+      if "py_peak_mb" in r:
+        r["mb_per_page"] = r["py_peak_mb"] / args.pages
+      if stage == 'pdf':
+        r["output_mb"] = os.path.getsize(annotations) / 2**20
+      elif stage == 'merge':
+        r["output_mb"] = os.path.getsize(merged) / 2**20
+      results[stage] = r
+      print("%-8s %8.3fs %8.1f pages/s" % (stage, r["seconds"], r["pages_per_sec"] or 0),
+            file=sys.stderr)
+
+    report = {
+      "environment": {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "qt": QT_VERSION_STR,
+        "pyqt": PYQT_VERSION_STR,
+        "numpy": np.__version__ if np is not None else None,
+        "qpa": os.environ.get('QT_QPA_PLATFORM'),
+      },
+      "parameters": {k: v for k, v in vars(args).items() if k != 'output'},
+      "stages": results,
+    }
+    if args.output:
+      with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    else:
+      json.dump(report, sys.stdout, indent=2)
+      print()
+  finally:
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,64 @@
+"""
+Decode many `.rm` files serially and through the process pool.
+
+Usage: python benchmarks/bench_pool.py [--pages N] [--strokes N] [--points N] [--processes N]
+"""
+import os
+import time
+import argparse
+import tempfile
+
+import synth
+from remy.remarkable.lines import readLines, np
+from remy.remarkable.decoder import DecoderPool
+
+
+def serial(paths):
+  for p in paths:
+    with open(p, 'rb') as f:
+      readLines(f)
+
+
+def pooled(pool, paths):
+  for r in pool.decode(paths):
+    if isinstance(r, Exception):
+      raise r
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument('--pages', type=int, default=200)
+  parser.add_argument('--strokes', type=int, default=1000)
+  parser.add_argument('--points', type=int, default=100)
+  parser.add_argument('--version', type=int, default=5, choices=(3, 5, 6))
+  parser.add_argument('--processes', type=int, default=None)
+  args = parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as d:
+    paths = [
+      synth.writePage(os.path.join(d, "%d.rm" % i), version=args.version,
+                      strokes=args.strokes, points=args.points, seed=i)
+      for i in range(args.pages)
+    ]
+    print("%d pages: v%d, %d strokes x %d points, numpy %s"
+          % (args.pages, args.version, args.strokes, args.points, np is not None))
+
+    t = time.perf_counter()
+    serial(paths)
+    ts = time.perf_counter() - t
+    print("serial     %8.3fs" % ts)
+
+    pool = DecoderPool(args.processes)
+    t = time.perf_counter()
+    pooled(pool, paths[:pool.processes]) # start the workers
+    tw = time.perf_counter() - t
+    t = time.perf_counter()
+    pooled(pool, paths)
+    tp = time.perf_counter() - t
+    pool.shutdown()
+    print("pool (%2d)  %8.3fs  (%.1fx, plus %.3fs to start the workers)"
+          % (pool.processes, tp, ts / tp, tw))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,102 @@
+"""
+Compare the computation of segment widths in bulk (segmentRuns with numpy)
+with calling the width function of the tool on every segment, on pencil
+heavy pages: time to split the strokes into runs of equal width and time
+of the whole pageOps.
+
+Usage: python benchmarks/bench_widths.py [--strokes N] [--points N] [--tools T1,T2,...]
+"""
+import io
+import os
+import time
+import argparse
+from contextlib import contextmanager
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import synth
+
+from remy.remarkable.lines import readLines, Layer
+from remy.remarkable.metadata import Page
+from remy.remarkable import render
+from remy.remarkable.render import (
+  pageOps, segmentRuns, pencil_width, mech_pencil_width, flat_pencil_width,
+  semi_dynamic_width, dynamic_width, quantized
+)
+from remy.remarkable.palette import Palette
+import remy.remarkable.constants as rm
+
+
+WIDTHS = {
+  rm.PENCIL_TOOL: pencil_width,
+  rm.MECH_PENCIL_TOOL: mech_pencil_width,
+  rm.BALLPOINT_TOOL: semi_dynamic_width,
+}
+
+
+@contextmanager
+def perSegment(enabled):
+  # segmentRuns falls back to the width functions without numpy
+  np = render.np
+  if enabled:
+    render.np = None
+  try:
+    yield
+  finally:
+    render.np = np
+
+
+def best(run, repeat):
+  t = float('inf')
+  for _ in range(repeat):
+    start = time.perf_counter()
+    out = run()
+    t = min(t, time.perf_counter() - start)
+  return t, out
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument('--strokes', type=int, default=1000)
+  parser.add_argument('--points', type=int, default=200)
+  parser.add_argument('--tools', default="pencil,mech_pencil,pencil,ballpoint")
+  parser.add_argument('--pencil-resolution', type=float, default=.4)
+  parser.add_argument('--batch-paths', action='store_true')
+  parser.add_argument('--repeat', type=int, default=3)
+  args = parser.parse_args()
+
+  synth.qapp()
+  data = synth.synthPage(strokes=args.strokes, points=args.points, tools=args.tools.split(','))
+  ver, layers = readLines(io.BytesIO(data))
+  page = Page([Layer(l, "Layer %d" % (i + 1), []) for i, l in enumerate(layers)], ver, 0, None)
+  strokes = [k for l in layers for k in l]
+  print("page: %d strokes x %d points, tools %s" % (args.strokes, args.points, args.tools))
+
+  options = {
+    "palette": Palette(),
+    "pencil_resolution": args.pencil_resolution,
+    "batch_paths": args.batch_paths,
+  }
+  if args.pencil_resolution <= 0:
+    WIDTHS[rm.PENCIL_TOOL] = flat_pencil_width
+
+  def runs():
+    n = 0
+    for k in strokes:
+      calcwidth = WIDTHS.get(rm.TOOL_ID.get(k.pen), dynamic_width)
+      if args.batch_paths:
+        calcwidth = quantized(calcwidth)
+      for _ in segmentRuns(k, calcwidth):
+        n += 1
+    return n
+
+  for slow in (True, False):
+    with perSegment(slow):
+      tr, n = best(runs, args.repeat)
+      to, _ = best(lambda: list(pageOps(page, **options)), args.repeat)
+    print("%-11s %7d runs  runs %7.3fs  pageOps %7.3fs"
+          % ("per segment" if slow else "bulk", n, tr, to))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,220 @@
+"""
+Synthetic reMarkable pages, for benchmarking.
+
+The generated files follow the v3/v5 `.lines` layout or the v6 block
+layout read by `remy.remarkable.lines`; strokes are random walks so that
+rendering has a realistic amount of work to do.
+Whole documents (metadata, content, pages and, optionally, a base PDF)
+can be written in the layout of the tablet's xochitl folder.
+"""
+import os
+import sys
+import json
+import math
+import random
+import struct
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from remy.remarkable.lines import (
+  HEADER_START, S_HEADER_PAGE, S_PAGE, S_LAYER,
+  S_STROKE_V3, S_STROKE_V5, S_SEGMENT,
+  S_BLOCK_HEADER, S_POINT_V2, BLOCK_TREE_NODE, BLOCK_GROUP_ITEM, BLOCK_LINE_ITEM,
+  TAG_ID, TAG_LENGTH4, TAG_BYTE8, TAG_BYTE4, TAG_BYTE1, ROOT_NODE, END_MARKER
+)
+from remy.remarkable.constants import WIDTH, HEIGHT
+
+# v5 pen codes for each tool name
+PEN_CODE = {
+  "brush": 12,
+  "mech_pencil": 13,
+  "pencil": 14,
+  "ballpoint": 15,
+  "marker": 16,
+  "fineliner": 17,
+  "highlighter": 18,
+  "eraser": 6,
+}
+
+DEFAULT_TOOLS = ("ballpoint", "fineliner", "pencil", "highlighter")
+
+
+def _strokes(rnd, strokes, points, tools):
+  for s in range(strokes):
+    tool = tools[s % len(tools)]
+    color = 0 if tool != "highlighter" else 3
+    width = rnd.choice((1.875, 2.0, 2.125))
+    if tool == "eraser":
+      width *= 10
+    x, y = rnd.uniform(0, WIDTH), rnd.uniform(0, HEIGHT)
+    segments = []
+    for p in range(points):
+      x = min(max(x + rnd.uniform(-3, 3), 0), WIDTH)
+      y = min(max(y + rnd.uniform(-3, 3), 0), HEIGHT)
+      pressure = rnd.uniform(.2, 1)
+      segments.append((x, y, rnd.uniform(0, 10), rnd.uniform(0, 6.28),
+                       width * (1 + pressure), pressure))
+    yield (PEN_CODE[tool], color, width, segments)
+
+
+def synthPage(version=5, layers=1, strokes=100, points=200, tools=DEFAULT_TOOLS, seed=0):
+  """Return the bytes of a `.rm` page with the given shape."""
+  rnd = random.Random(seed)
+  out = bytearray()
+  header = HEADER_START + str(version).encode()
+  out += S_HEADER_PAGE.pack(header[:len(HEADER_START)], header[-1:], b' ' * 10)
+  if version == 6:
+    out += _scene(rnd, [list(_strokes(rnd, strokes, points, tools)) for l in range(layers)])
+    return bytes(out)
+  out += S_PAGE.pack(layers, 0, 0)
+  for l in range(layers):
+    out += S_LAYER.pack(strokes)
+    for (pen, color, width, segments) in _strokes(rnd, strokes, points, tools):
+      if version == 3:
+        out += S_STROKE_V3.pack(pen, color, 0, width, points)
+      else:
+        out += S_STROKE_V5.pack(pen, color, 0, width, 0, points)
+      for s in segments:
+        out += S_SEGMENT.pack(*s)
+  return bytes(out)
+
+
+# v6 encoding
+
+def _varuint(n):
+  out = bytearray()
+  while n >= 0x80:
+    out.append(n & 0x7F | 0x80)
+    n >>= 7
+  out.append(n)
+  return bytes(out)
+
+def _tag(index, ttype):
+  return _varuint(index << 4 | ttype)
+
+def _id(index, cid):
+  return _tag(index, TAG_ID) + bytes([cid[0]]) + _varuint(cid[1])
+
+def _sub(index, body):
+  return _tag(index, TAG_LENGTH4) + struct.pack('<I', len(body)) + body
+
+def _string(index, s):
+  b = s.encode('utf-8')
+  return _sub(index, _varuint(len(b)) + b'\x01' + b)
+
+def _block(btype, body, version=2):
+  return S_BLOCK_HEADER.pack(len(body), 0, 1, version, btype) + body
+
+def _item(btype, parent, item, left, value):
+  return _block(btype, _id(1, parent) + _id(2, item) + _id(3, left) + _id(4, END_MARKER)
+                + _tag(5, TAG_BYTE4) + struct.pack('<I', 0) + _sub(6, value))
+
+def _point(x, y, speed, direction, width, pressure):
+  return S_POINT_V2.pack(x - WIDTH / 2, y, round(speed * 4), round(width * 4),
+                         round(direction * 255 / (2 * math.pi)) % 256, round(pressure * 255))
+
+def _scene(rnd, layers):
+  """Blocks of a scene tree with the given layers of strokes, in shuffled order."""
+  ids = iter(range(10, 2**31))
+  blocks = []
+  left = END_MARKER
+  for l, strokes in enumerate(layers):
+    node, item = (0, next(ids)), (0, next(ids))
+    blocks.append(_block(BLOCK_TREE_NODE,
+      _id(1, node)
+      + _sub(2, _id(1, (0, 1)) + _string(2, "Layer %d" % (l + 1)))
+      + _sub(3, _id(1, (0, 1)) + _tag(2, TAG_BYTE1) + b'\x01')))
+    blocks.append(_item(BLOCK_GROUP_ITEM, ROOT_NODE, item, left, b'\x02' + _id(2, node)))
+    left = item
+    kleft = END_MARKER
+    for (pen, color, width, segments) in strokes:
+      kitem = (1, next(ids))
+      value = (b'\x03'
+        + _tag(1, TAG_BYTE4) + struct.pack('<I', pen)
+        + _tag(2, TAG_BYTE4) + struct.pack('<I', color)
+        + _tag(3, TAG_BYTE8) + struct.pack('<d', width)
+        + _tag(4, TAG_BYTE4) + struct.pack('<f', 0)
+        + _sub(5, b''.join(_point(*s) for s in segments))
+        + _id(6, (0, 1)))
+      blocks.append(_item(BLOCK_LINE_ITEM, node, kitem, kleft, value))
+      kleft = kitem
+  # the order of items comes from the CRDT links, not from the file
+  rnd.shuffle(blocks)
+  return b''.join(blocks)
+
+
+def writePage(path, **kw):
+  with open(path, 'wb') as f:
+    f.write(synthPage(**kw))
+  return path
+
+
+_app = None
+
+def qapp():
+  """
+  Create the QApplication that rendering needs, once: it is kept here so
+  that it lives as long as the process.
+  """
+  global _app
+  if _app is None:
+    from PyQt5.QtWidgets import QApplication
+    _app = QApplication.instance() or QApplication([])
+  return _app
+
+
+def writePdf(path, pages=10, seed=0):
+  """
+  Write a PDF with `pages` A4 pages of text and shapes.
+  Uses Qt, so a QGuiApplication must exist.
+  """
+  from PyQt5.QtCore import QRectF
+  from PyQt5.QtGui import QPdfWriter, QPainter, QPageSize, QFont
+
+  rnd = random.Random(seed)
+  writer = QPdfWriter(path)
+  writer.setPageSize(QPageSize(QPageSize.A4))
+  writer.setResolution(72)
+  p = QPainter(writer)
+  try:
+    font = QFont()
+    font.setPointSize(10)
+    p.setFont(font)
+    for i in range(pages):
+      if i > 0:
+        writer.newPage()
+      p.drawText(40, 40, "Synthetic page %d" % (i + 1))
+      for l in range(50):
+        words = " ".join("w%d" % rnd.randrange(1000) for _ in range(12))
+        p.drawText(40, 70 + l * 14, words)
+      for r in range(5):
+        p.drawRect(QRectF(rnd.uniform(40, 400), rnd.uniform(40, 700), 120, 60))
+  finally:
+    p.end()
+  return path
+
+
+def writeDocument(root, uid, pages=10, pdf=False, marked=None, **kw):
+  """
+  Write a notebook, or with `pdf` an annotated PDF, with `pages` pages.
+  Only the first `marked` pages get a `.rm` file (all by default);
+  `kw` is passed to `synthPage`.
+  """
+  os.makedirs(os.path.join(root, uid), exist_ok=True)
+  pids = ["%s-p%d" % (uid, i) for i in range(pages)]
+  with open(os.path.join(root, uid + ".metadata"), "w") as f:
+    json.dump({
+      "visibleName": uid, "type": "DocumentType", "parent": "",
+      "deleted": False, "lastModified": "1"
+    }, f)
+  with open(os.path.join(root, uid + ".content"), "w") as f:
+    json.dump({
+      "fileType": "pdf" if pdf else "notebook", "pages": pids,
+      "pageCount": pages, "orientation": "portrait"
+    }, f)
+  if pdf:
+    writePdf(os.path.join(root, uid + ".pdf"), pages)
+  for i, pid in enumerate(pids[:marked]):
+    writePage(os.path.join(root, uid, pid + ".rm"), seed=i, **kw)
+  return pids
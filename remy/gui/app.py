@@ -17,6 +17,7 @@ from remy.remarkable.filesource import (
 )
 import remy.gui.resources
 from remy.gui.notebookview import *
+from remy.gui.notebookview.pool import renderQueue
 from remy.gui.browser import *
 from remy.connect import connect, BadHostKeyException, UnknownHostKeyException
 
@@ -59,6 +60,7 @@ class RemyApp(QApplication):
   @pyqtSlot()
   def cleanup(self):
     log.info("Waiting for stray threads")
+    renderQueue().waitForDone()
     QThreadPool.globalInstance().waitForDone()
     log.info("Done waiting")
     if self.fsource:
@@ -380,7 +382,8 @@ class RemyInitWorker(QRunnable):
       self._progress(0,0,"Fetching metadata")
       fsource.prefetchMetadata(progress=self._progress)
       self._progress(0,0,"Building index")
-      index = QRemarkableIndex(fsource, progress=self._progress)
+      index = QRemarkableIndex(fsource, progress=self._progress,
+                               cache_size=app.config.get('memory_cache_size') * 2**20)
       self._progress(4,4,"Done")
       log.info('LOAD TIME: %f', time.perf_counter() - T0)
       self.signals.success.emit(index)
@@ -112,7 +112,8 @@ class NotebookViewer(QMainWindow):
     webUIExport(self.view.document(), filename, self)
 
   def mathpix(self):
-    page = self.view.currentPage()
+    # HWR excludes most tools: no need to decode their strokes
+    page = self.view.currentPage(mapped=True)
     pageNum = self.view.currentPageNum()
     opt = QApplication.instance().config.mathpix
     w = HWRResults(page, opt)
@@ -0,0 +1,88 @@
+from PyQt5.QtCore import QRunnable, QThreadPool
+
+
+class CancelledRender(Exception):
+  pass
+
+
+class RenderToken():
+  """
+  Shared by a job and whoever scheduled it, which can cancel the job
+  while it runs.  The renderers call `check` between strokes, by passing
+  it as their `progress` callback.
+  """
+
+  def __init__(self):
+    self.cancelled = False
+
+  def cancel(self):
+    self.cancelled = True
+
+  def check(self, *args):
+    if self.cancelled:
+      raise CancelledRender("Render was cancelled")
+
+
+class RenderJob(QRunnable):
+  """
+  A job of the RenderQueue: subclasses implement `render`, which is
+  skipped if the job is cancelled before running and stopped by
+  `token.check` if it is cancelled while running.
+  """
+
+  def __init__(self):
+    QRunnable.__init__(self)
+    self.token = RenderToken()
+    self.started = False
+    self.priority = 0
+
+  def render(self):
+    pass
+
+  def run(self):
+    self.started = True
+    if self.token.cancelled:
+      return
+    try:
+      self.render()
+    except CancelledRender:
+      pass
+
+
+class RenderQueue():
+  """
+  Runs the rendering jobs of the previews on a pool of their own:
+  Qt splits some image operations (e.g. smooth scaling) into tasks of the
+  global pool and waits for them, so filling the global pool with our jobs
+  could leave the GUI thread waiting forever on machines with few cores.
+  Jobs waiting for a thread are run by priority, and can be moved or
+  cancelled until they start.
+  """
+
+  def __init__(self):
+    self.pool = QThreadPool()
+
+  def start(self, job, priority=0):
+    job.priority = priority
+    self.pool.start(job, priority)
+
+  def setPriority(self, job, priority):
+    # only affects jobs which are still waiting
+    if job.priority != priority and not job.started and self.pool.tryTake(job):
+      self.start(job, priority)
+
+  def cancel(self, job):
+    job.token.cancel()
+    if not job.started:
+      self.pool.tryTake(job)
+
+  def waitForDone(self):
+    self.pool.waitForDone()
+
+
+_renderQueue = None
+def renderQueue():
+  global _renderQueue
+  if _renderQueue is None:
+    _renderQueue = RenderQueue()
+  return _renderQueue
@@ -0,0 +1,163 @@
+from PyQt5.QtGui import *
+from PyQt5.QtWidgets import *
+from PyQt5.QtCore import *
+
+import remy.remarkable.constants as rm
+
+import math
+
+from remy.utils import log, LRUCache
+from remy.gui.notebookview.pool import renderQueue
+
+
+# side of a tile in device pixels
+TILE_SIZE = 256
+
+
+_tileCache = None
+def tileCache(max_size=64 * 2**20):
+  # images of tiles shared by all the views, evicted by their size in bytes
+  global _tileCache
+  if _tileCache is None:
+    _tileCache = LRUCache(max_size, sizeof=lambda img: img.sizeInBytes())
+  return _tileCache
+
+def optionsKey(options):
+  # identifies the render options in the keys of tiles
+  return tuple(sorted((k, repr(v)) for (k, v) in options.items()))
+
+
+class TileSignals(QObject):
+  tileReady = pyqtSignal(object, QImage)
+
+class TileJob(QRunnable):
+
+  def __init__(self, owner, key, level, tx, ty):
+    QRunnable.__init__(self)
+    self.owner = owner
+    self.key = key
+    self.level = level
+    self.tx = tx
+    self.ty = ty
+    self.signals = TileSignals()
+
+  def run(self):
+    if not self.owner.wanted(self.key):
+      # scrolled out of view before its turn
+      self.signals.tileReady.emit(self.key, QImage())
+      return
+    try:
+      img = self.owner.renderTile(self.level, self.tx, self.ty)
+    except Exception as e:
+      log.warning("Could not render tile %s [%s]", self.key, e)
+      img = QImage()
+    self.signals.tileReady.emit(self.key, img)
+
+
+class PageTilesItem(QGraphicsItem):
+  """
+  Shows a page as tiles of TILE_SIZE device pixels, rendered in the
+  background by `pagePainter` (a PagePainter) over the `base` image,
+  which is `baseMult` times the size of the page.
+  There is a level of tiles for each power of 2 of the scale, and each
+  level is rendered at the next power of 2 above the scale of the view.
+  Tiles are kept in the shared `tileCache`, under `key` which should
+  change with anything affecting the rendering.
+  Missing tiles are drawn from `fallback`, a pixmap of the whole page,
+  until they are ready.
+  """
+
+  def __init__(self, pagePainter, key, base=None, baseMult=1, fallback=None, parent=None):
+    QGraphicsItem.__init__(self, parent)
+    self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+    self.pagePainter = pagePainter
+    self.key = key
+    self.base = base
+    self.baseMult = baseMult
+    self.fallback = fallback
+    self._pending = set()
+    self._wanted = set()
+
+  def boundingRect(self):
+    return QRectF(0, 0, rm.WIDTH, rm.HEIGHT)
+
+  def setFallback(self, pixmap):
+    self.fallback = pixmap
+    self.update()
+
+  def wanted(self, key):
+    return key in self._wanted
+
+  def renderTile(self, level, tx, ty):
+    # runs in the workers
+    scale = 2 ** level
+    side = TILE_SIZE / scale
+    source = QRectF(tx * side, ty * side, side, side)
+    img = QImage(TILE_SIZE, TILE_SIZE, QImage.Format_ARGB32_Premultiplied)
+    img.fill(Qt.white)
+    painter = QPainter(img)
+    try:
+      painter.setRenderHint(QPainter.Antialiasing)
+      painter.setRenderHint(QPainter.SmoothPixmapTransform)
+      target = QRectF(img.rect())
+      if self.base is not None:
+        m = self.baseMult
+        painter.drawImage(target, self.base,
+                          QRectF(source.x() * m, source.y() * m, side * m, side * m))
+      self.pagePainter.render(painter, target, source)
+    finally:
+      painter.end()
+    return img
+
+  def _request(self, key, level, tx, ty):
+    if key in self._pending:
+      return
+    self._pending.add(key)
+    job = TileJob(self, key, level, tx, ty)
+    job.signals.tileReady.connect(self._tileReady)
+    renderQueue().start(job)
+
+  def _tileReady(self, key, img):
+    self._pending.discard(key)
+    if not img.isNull():
+      tileCache().put(key, img)
+      (_, level, tx, ty) = key
+      side = TILE_SIZE / 2 ** level
+      self.update(QRectF(tx * side, ty * side, side, side))
+
+  def paint(self, painter, option, widget=None):
+    t = painter.deviceTransform()
+    scale = math.hypot(t.m11(), t.m12())
+    level = max(0, math.ceil(math.log2(scale))) if scale > 0 else 0
+    side = TILE_SIZE / 2 ** level
+    exposed = option.exposedRect.intersected(self.boundingRect())
+    visible = self.boundingRect()
+    if widget is not None:
+      inv, ok = t.inverted()
+      if ok:
+        visible = inv.mapRect(QRectF(widget.rect())).intersected(visible)
+    x0, y0 = int(exposed.left() // side), int(exposed.top() // side)
+    x1, y1 = int(math.ceil(exposed.right() / side)), int(math.ceil(exposed.bottom() / side))
+    painter.setRenderHint(QPainter.SmoothPixmapTransform)
+    cache = tileCache()
+    # pending tiles outside of the view are not rendered
+    self._wanted = set(
+      (self.key, level, tx, ty)
+      for ty in range(int(visible.top() // side), int(math.ceil(visible.bottom() / side)))
+      for tx in range(int(visible.left() // side), int(math.ceil(visible.right() / side)))
+    )
+    for ty in range(y0, y1):
+      for tx in range(x0, x1):
+        key = (self.key, level, tx, ty)
+        target = QRectF(tx * side, ty * side, side, side)
+        img = cache.get(key)
+        if img is not None:
+          painter.drawImage(target, img)
+          continue
+        self._request(key, level, tx, ty)
+        if self.fallback is not None:
+          f = self.fallback.width() / rm.WIDTH
+          painter.drawPixmap(target, self.fallback,
+                             QRectF(target.x() * f, target.y() * f, side * f, side * f))
+        else:
+          painter.fillRect(target, Qt.white)
@@ -7,12 +7,20 @@ from PyQt5.QtPrintSupport import *
 
 import remy.remarkable.constants as rm
 
-from remy.remarkable.render import PageGraphicsItem
+from remy.remarkable.render import (
+  PageGraphicsItem, PagePainter, needsAccurateEraser,
+  BackgroundItem, backgroundTemplate,
+  ERASER_MODE, AUTO_ERASER, ACCURATE_ERASER
+)
 from remy.gui.export import exportDocument
+from remy.gui.notebookview.tiles import PageTilesItem, tileCache, optionsKey
+from remy.gui.notebookview.pool import renderQueue, RenderJob
 
 from os import path
+from bisect import bisect_left, bisect_right
+import math
 
-from remy.utils import log
+from remy.utils import log, LRUCache
 
 
 class Actions:
@@ -56,6 +64,29 @@ class NotebookView(QGraphicsView):
   zoomInFactor = 1.25
   zoomOutFactor = 1 / zoomInFactor
 
+  # number of page scenes kept around for quick navigation
+  sceneCacheSize = 12
+
+  # pages within readAhead of the current one, and the next and previous
+  # marked pages (once AsyncMarkedPages has found them), are loaded in the
+  # background at prefetchPriority
+  # (the `read_ahead` preview option overrides readAhead);
+  # the loading of any other page is cancelled when the page changes
+  readAhead = 2
+  prefetchPriority = -1
+
+  # Level of detail, by the scale of the view in device pixels per page pixel.
+  # Below rasterBelowScale the page is shown as an image rendered at that scale,
+  # which is much quicker to paint than the strokes.
+  # Above tilesAboveScale the page is shown as tiles rendered in the
+  # background (see PageTilesItem), so that panning does not repaint strokes.
+  # Base pdfs are rasterised at baseOversampling, and at higher resolutions
+  # (up to maxBaseOversampling) while zoomed in on the page.
+  rasterBelowScale = .75
+  tilesAboveScale = 1.5
+  baseOversampling = 2
+  maxBaseOversampling = 4
+
   pageChanged = pyqtSignal(int, int)
   resetSize = pyqtSignal(float)
 
@@ -73,6 +104,7 @@ class NotebookView(QGraphicsView):
 
     self._document = document
     self.options = QApplication.instance().config.preview
+    self.readAhead = self.options.pop('read_ahead', self.readAhead)
     # document.prefetch()
     # self.uid = uid
 
@@ -101,14 +133,20 @@ class NotebookView(QGraphicsView):
     self._fit = True
     self._rotation = 0 # used to produce a rotated screenshot
 
-    self._page_cache = {}
+    self._page_cache = LRUCache(max(self.sceneCacheSize, 2 * self.readAhead + 4))
+    self._loading = {} # page number -> scene, while its loader is pending
+    tileCache(QApplication.instance().config.get('tile_cache_size', 64) * 2**20)
     self._page = 0
-    self._templates = {}
     # we only support pdfs for the forseable future
     self._maxPage = document.totalPageCount() - 1
     # if isinstance(document, PDFDoc):
     #   self._maxPage = document.baseDocument().numPages() - 1
+    self._marked = None # sorted numbers of the marked pages, when known
     self._loadPage(document.lastOpenedPage or 0)
+    # finding the marked pages may take a request per page (e.g. over ssh)
+    w = AsyncMarkedPages(document, self._maxPage + 1)
+    w.signals.markedReady.connect(self._markedReady)
+    renderQueue().start(w, self.prefetchPriority)
 
     self.show()
     if document.orientation == "landscape":
@@ -133,32 +171,61 @@ class NotebookView(QGraphicsView):
     a.firstPage.triggered.connect(self.firstPage)
     a.lastPage.triggered.connect(self.lastPage)
 
-  def imageOfBackground(self, bg):
-    if bg and bg.name not in self._templates:
-      bgf = bg.retrieve()
-      if bgf:
-        self._templates[bg.name] = QImage(bgf)
-      else:
-        return None
-    return self._templates[bg.name]
-
   def _loadPage(self, i):
     # ermode = self.options.get("eraser_mode", "ignore")
     # pres = self.options.get("pencil_resolution", 0.4)
     # pal = self.options.get("palette", {})
     # scene = self.makePageScene(i, eraser_mode=ermode, pencil_resolution=pres, palette=pal)
     scene = self.makePageScene(i, **self.options)
+    if scene.loader is not None:
+      # it may be waiting as a prefetch: it is needed now
+      renderQueue().setPriority(scene.loader, 0)
+    old = self.scene()
+    if old is not None and old is not scene:
+      self._resetBaseDetail(old)
     self.setScene(scene)
+    self._updateDetail()
     old_page = self._page
     self._page = i
     # self.refreshTitle()
     self.pageChanged.emit(old_page+1, self._page+1)
-
-  def makePageScene(self, i, replace=False, **options):
+    self._schedule(i)
+
+  def _schedule(self, i):
+    # Only the current page i loads at full priority: the pages around it
+    # are prefetched and the loading of the pages the user left is dropped
+    pages = [p for d in range(1, self.readAhead + 1) for p in (i + d, i - d)
+             if 0 <= p <= self._maxPage]
+    for p in (self._markedFrom(i, 1), self._markedFrom(i, -1)):
+      if p is not None and p not in pages:
+        pages.append(p)
+    queue = renderQueue()
+    for p, scene in list(self._loading.items()):
+      if p == i:
+        continue
+      if p in pages and self._page_cache.get(p) is scene:
+        queue.setPriority(scene.loader, self.prefetchPriority)
+      else:
+        self._cancelLoad(p, scene)
+    for p in pages:
+      if p not in self._page_cache:
+        self.makePageScene(p, priority=self.prefetchPriority, **self.options)
+
+  def _cancelLoad(self, i, scene):
+    renderQueue().cancel(scene.loader)
+    scene.loader = None
+    del self._loading[i]
+    if self._page_cache.get(i) is scene:
+      self._page_cache.pop(i) # half loaded
+
+  def makePageScene(self, i, replace=False, priority=0, **options):
     if not replace and i in self._page_cache:
-      return self._page_cache[i]
+      return self._page_cache.get(i)
+    if i in self._loading:
+      self._cancelLoad(i, self._loading[i])
 
-    scene = self._page_cache[i] = QGraphicsScene()
+    scene = QGraphicsScene()
+    self._page_cache.put(i, scene)
     r = scene.pageRect = scene.addRect(0,0,rm.WIDTH, rm.HEIGHT)
     r.setFlag(QGraphicsItem.ItemClipsChildrenToShape)
     r.setBrush(Qt.white)
@@ -171,31 +238,181 @@ class NotebookView(QGraphicsView):
     scene.loadingItem.setPos(r.rect().center())
 
 
-    w = AsyncPageLoad(self._document, i, **options)
+    scene.strokeItems = []
+    scene.page = None
+    scene.baseItem = None
+    scene.baseImage = None
+    scene.baseMult = self.baseOversampling
+    scene.rasterItem = None
+    scene.tilesItem = None
+    scene.pagePainter = None
+    scene.hiBaseImage = None
+    scene.pendingJobs = set()
+    scene.options = options
+
+    w = AsyncPageLoad(self._document, i, progressive=True, oversampling=self.baseOversampling, **options)
+    w.signals.strokesReady.connect(self.strokesReady)
+    w.signals.pageReset.connect(self.pageReset)
     w.signals.pageReady.connect(self.pageReady)
-    QThreadPool.globalInstance().start(w)
+    scene.loader = w
+    self._loading[i] = scene
+    renderQueue().start(w, priority)
     return scene
 
-
-  @pyqtSlot(Page, PageGraphicsItem, QImage)
-  def pageReady(self, page, pitem, img):
-    scene = self._page_cache[page.pageNum]
+  def _addStrokes(self, scene, items):
+    if scene.loadingItem is not None:
+      scene.removeItem(scene.loadingItem)
+      scene.loadingItem = None
+    for pitem in items:
+      pitem.setParentItem(scene.pageRect)
+      pitem.setVisible(not self._replaced(scene))
+    scene.strokeItems.extend(items)
+
+  def _loadingScene(self, pageNum):
+    # the scene loaded by the sender, unless it was dropped or replaced since
+    scene = self._loading.get(pageNum)
+    if scene is not None and scene.loader.signals is self.sender():
+      return scene
+    return None
+
+  @pyqtSlot(int, object)
+  def strokesReady(self, pageNum, items):
+    scene = self._loadingScene(pageNum)
+    if scene is not None:
+      self._addStrokes(scene, items)
+
+  @pyqtSlot(int)
+  def pageReset(self, pageNum):
+    scene = self._loadingScene(pageNum)
+    if scene is not None:
+      for pitem in scene.strokeItems:
+        scene.removeItem(pitem)
+      scene.strokeItems = []
+
+  @pyqtSlot(Page, object, QImage)
+  def pageReady(self, page, items, img):
+    scene = self._loadingScene(page.pageNum)
+    if scene is None:
+      return # dropped while loading
+    scene.loader = None
+    del self._loading[page.pageNum]
+    scene.page = page
     if page.background and page.background.name != "Blank":
-      img = self.imageOfBackground(page.background)
-      if img:
-        scene.baseItem = QGraphicsPixmapItem(QPixmap(img), scene.pageRect)
+      bg = backgroundTemplate(page.background)
+      if bg:
+        scene.baseItem = BackgroundItem(bg, scene.pageRect)
+        if bg.isVector():
+          # drawn again only when the zoom changes
+          scene.baseItem.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
     elif img:
+      scene.baseImage = img
       img = QGraphicsPixmapItem(QPixmap(img), scene.pageRect)
       img.setTransformationMode(Qt.SmoothTransformation)
-      img.setScale(1/2)
+      img.setScale(1/scene.baseMult)
       scene.baseItem = img
     else:
       scene.baseItem = None
-    scene.removeItem(scene.loadingItem)
-    pitem.setParentItem(scene.pageRect)
+    if scene.baseItem is not None:
+      scene.baseItem.setZValue(-1) # below strokes loaded earlier
+    self._addStrokes(scene, items)
     scene.setSceneRect(scene.pageRect.rect())
     r=scene.addRect(0,0,rm.WIDTH, rm.HEIGHT)
     r.setPen(Qt.black)
+    if scene is self.scene():
+      self._updateDetail()
+
+  def viewScale(self):
+    # device pixels per page pixel
+    t = self.transform()
+    return math.hypot(t.m11(), t.m12()) * self.devicePixelRatioF()
+
+  def _replaced(self, scene):
+    # whether the strokes are shown by the raster or the tiles
+    return ((scene.rasterItem is not None and scene.rasterItem.isVisible())
+            or (scene.tilesItem is not None and scene.tilesItem.isVisible()))
+
+  def _updateDetail(self):
+    # switches between the raster, the strokes and the tiles of the current
+    # page and loads higher resolutions of the base pdf, according to the scale
+    scene = self.scene()
+    if scene is None or scene.page is None:
+      return # still loading
+    scale = self.viewScale()
+    low = scale < self.rasterBelowScale
+    high = scale > self.tilesAboveScale
+    if (low or high) and scene.pagePainter is None:
+      if 'raster' not in scene.pendingJobs:
+        scene.pendingJobs.add('raster')
+        w = AsyncPageRaster(scene.page, scene.baseImage, self.baseOversampling, self.rasterBelowScale, **scene.options)
+        w.signals.rasterReady.connect(lambda pp, img, scene=scene: self._rasterReady(scene, pp, img))
+        renderQueue().start(w)
+    if high and scene.tilesItem is None and scene.pagePainter is not None:
+      key = (self._document.uid, scene.page.pageNum, optionsKey(scene.options), scene.baseMult)
+      scene.tilesItem = PageTilesItem(
+        scene.pagePainter, key,
+        base=scene.hiBaseImage or scene.baseImage,
+        baseMult=scene.baseMult,
+        fallback=scene.rasterItem.pixmap() if scene.rasterItem else None,
+        parent=scene.pageRect
+      )
+      scene.tilesItem.setZValue(2 * len(scene.page.layers) + 2) # above all strokes
+    if scene.rasterItem is not None:
+      scene.rasterItem.setVisible(low)
+    if scene.tilesItem is not None:
+      scene.tilesItem.setVisible(high)
+    replaced = self._replaced(scene)
+    for pitem in scene.strokeItems:
+      pitem.setVisible(not replaced)
+    if scene.baseItem is not None:
+      scene.baseItem.setVisible(not replaced)
+    if not low and scene.baseImage is not None:
+      mult = min(math.ceil(scale), self.maxBaseOversampling)
+      if mult > scene.baseMult and mult not in scene.pendingJobs:
+        scene.pendingJobs.add(mult)
+        w = AsyncBaseImage(self._document, scene.page.pageNum, mult)
+        w.signals.imageReady.connect(lambda mult, img, scene=scene: self._baseReady(scene, mult, img))
+        renderQueue().start(w)
+
+  def _rasterReady(self, scene, pagePainter, img):
+    scene.pendingJobs.discard('raster')
+    scene.pagePainter = pagePainter
+    item = QGraphicsPixmapItem(QPixmap.fromImage(img), scene.pageRect)
+    item.setTransformationMode(Qt.SmoothTransformation)
+    item.setScale(1/self.rasterBelowScale)
+    item.setZValue(2 * len(scene.page.layers) + 1) # above all strokes
+    item.setVisible(False)
+    scene.rasterItem = item
+    if scene is self.scene():
+      self._updateDetail()
+
+  def _baseReady(self, scene, mult, img):
+    scene.pendingJobs.discard(mult)
+    if img.isNull() or scene.baseItem is None or mult <= scene.baseMult:
+      return
+    if scene is not self.scene():
+      return # the page was left in the meantime
+    scene.baseItem.setPixmap(QPixmap.fromImage(img))
+    scene.baseItem.setScale(1/mult)
+    scene.baseMult = mult
+    scene.hiBaseImage = img
+    self._resetTiles(scene)
+
+  def _resetBaseDetail(self, scene):
+    # higher resolutions of the base are only kept for the current page
+    if getattr(scene, 'baseImage', None) is not None and scene.baseMult > self.baseOversampling:
+      scene.baseItem.setPixmap(QPixmap.fromImage(scene.baseImage))
+      scene.baseItem.setScale(1/self.baseOversampling)
+      scene.baseMult = self.baseOversampling
+      scene.hiBaseImage = None
+      self._resetTiles(scene)
+
+  def _resetTiles(self, scene):
+    # tiles are created again, with the current base
+    if getattr(scene, 'tilesItem', None) is not None:
+      scene.removeItem(scene.tilesItem)
+      scene.tilesItem = None
+      if scene is self.scene():
+        self._updateDetail()
 
 
   # def resetSize.emit(self, ratio):
@@ -210,8 +427,8 @@ class NotebookView(QGraphicsView):
   def document(self):
     return self._document
 
-  def currentPage(self):
-    return self._document.getPage(self._page)
+  def currentPage(self, mapped=False):
+    return self._document.getPage(self._page, mapped=mapped)
 
   def currentPageNum(self):
     return self._page+1
@@ -247,22 +464,40 @@ class NotebookView(QGraphicsView):
       return True
     return False
 
-  def nextMarkedPage(self):
-    p = self._page
-    while p < self._maxPage:
-      p +=1
+  def _markedReady(self, marked):
+    self._marked = marked
+    self._schedule(self._page)
+
+  def _markedFrom(self, p, step, scan=False):
+    # the first marked page after p, going in the direction of step;
+    # while the marked pages are not known, None unless `scan`
+    if self._marked is not None:
+      if step > 0:
+        k = bisect_right(self._marked, p)
+      else:
+        k = bisect_left(self._marked, p) - 1
+      return self._marked[k] if 0 <= k < len(self._marked) else None
+    if not scan:
+      return None
+    p += step
+    while 0 <= p <= self._maxPage:
       if self._document.marked(p):
-        self._loadPage(p)
-        return True
+        return p
+      p += step
+    return None
+
+  def nextMarkedPage(self):
+    p = self._markedFrom(self._page, 1, scan=True)
+    if p is not None:
+      self._loadPage(p)
+      return True
     return False
 
   def prevMarkedPage(self):
-    p = self._page
-    while p > 0:
-      p -=1
-      if self._document.marked(p):
-        self._loadPage(p)
-        return True
+    p = self._markedFrom(self._page, -1, scan=True)
+    if p is not None:
+      self._loadPage(p)
+      return True
     return False
 
   # def refreshTitle(self):
@@ -275,6 +510,7 @@ class NotebookView(QGraphicsView):
   def updateViewer(self):
     if self._fit:
       self.fitInView(self.sceneRect(), self.aspectRatioMode)
+      self._updateDetail()
     # else:
 
   def resizeEvent(self, event):
@@ -286,6 +522,7 @@ class NotebookView(QGraphicsView):
       if pinch is not None:
         self._fit = False
         self.scale(pinch.scaleFactor(), pinch.scaleFactor())
+        self._updateDetail()
         return True
     return bool(QGraphicsView.viewportEvent(self, event))
 
@@ -324,6 +561,7 @@ class NotebookView(QGraphicsView):
       # Move scene to old position
       delta = newPos - oldPos
       self.translate(delta.x(), delta.y())
+      self._updateDetail()
 
   def rotateCW(self):
     self.rotate(90)
@@ -338,10 +576,12 @@ class NotebookView(QGraphicsView):
   def zoomIn(self):
     self._fit = False
     self.scale(self.zoomInFactor, self.zoomInFactor)
+    self._updateDetail()
 
   def zoomOut(self):
     self._fit = False
     self.scale(self.zoomOutFactor, self.zoomOutFactor)
+    self._updateDetail()
 
   def setFit(self, f):
     self._fit = f
@@ -352,6 +592,7 @@ class NotebookView(QGraphicsView):
     self.resetTransform()
     self.scale(1/self.devicePixelRatio(), 1/self.devicePixelRatio())
     self.rotate(self._rotation)
+    self._updateDetail()
 
   def export(self):
     exportDocument(self._document, self)
@@ -394,6 +635,7 @@ class NotebookView(QGraphicsView):
       self._tolerance.setdefault(i, 0)
       self.makePageScene(i, replace=True, simplify=self._tolerance[i], smoothen=self._smoothen)
       self.setScene(self._page_cache[i])
+      self._updateDetail()
     elif event.key() == Qt.Key_S:
       i = self._page
       self._tolerance.setdefault(i, .5)
@@ -405,18 +647,39 @@ class NotebookView(QGraphicsView):
       log.info("Tolerance: %g", self._tolerance[i])
       self.makePageScene(i, replace=True, simplify=self._tolerance[i], smoothen=self._smoothen)
       self.setScene(self._page_cache[i])
+      self._updateDetail()
 
 
 class AsyncPageLoadSignals(QObject):
-  pageReady = pyqtSignal(Page, PageGraphicsItem, QImage)
-
-class AsyncPageLoad(QRunnable):
-
-  def __init__(self, document, i, **kw):
-    QRunnable.__init__(self)
+  pageReady = pyqtSignal(Page, object, QImage)
+  strokesReady = pyqtSignal(int, object)
+  pageReset = pyqtSignal(int)
+
+class AsyncPageLoad(RenderJob):
+  """
+  Loads a page in the background, emitting `pageReady` with the
+  graphics items of its strokes and the image of its base pdf page.
+
+  When `progressive` the page is streamed and its strokes are emitted
+  in batches with `strokesReady`, so that the page is displayed while it
+  loads.  The first batch has `batchSize` strokes and each following one
+  is twice as large as the previous.  Batches are rendered separately,
+  which is only faithful as long as no eraser needs to be rendered
+  accurately: when one is found, `pageReset` is emitted and the whole
+  page is rendered at once when complete.
+
+  Nothing is emitted after the job is cancelled through its `token`.
+  """
+
+  batchSize = 64
+
+  def __init__(self, document, i, progressive=False, oversampling=2, **kw):
+    RenderJob.__init__(self)
     self.document = document
     self.pageNum = i
-    self.options = kw
+    self.progressive = progressive
+    self.oversampling = oversampling
+    self.options = dict(kw, progress=self.token.check)
     self.signals = AsyncPageLoadSignals()
 
   def imageOfBasePdf(self, mult=1):
@@ -426,19 +689,166 @@ class AsyncPageLoad(QRunnable):
     else:
       return QImage()
 
-  def run(self):
-    page = self.document.getPage(self.pageNum)
-    # try:
+  def baseImage(self, page):
     if page.background and page.background.name != "Blank":
-      page.background.retrieve()
-      img = QImage()
-      # images are cached
+      # templates are loaded here and shared (see backgroundTemplate)
+      backgroundTemplate(page.background)
+      return QImage()
     else:
-      # todo: adapt the oversampling based on QGraphicsView scale
-      img = self.imageOfBasePdf(2)
-    p = PageGraphicsItem(page, **self.options)
-    self.signals.pageReady.emit(page, p, img)
+      # higher resolutions are loaded when zooming in (see NotebookView)
+      return self.imageOfBasePdf(self.oversampling)
+
+  def render(self):
+    eraser_mode = self.options.get('eraser_mode', AUTO_ERASER)
+    if isinstance(eraser_mode, str):
+      eraser_mode = ERASER_MODE.get(eraser_mode, AUTO_ERASER)
+    if not self.progressive or eraser_mode == ACCURATE_ERASER:
+      page = self.document.getPage(self.pageNum)
+      p = PageGraphicsItem(page, **self.options)
+      img = self.baseImage(page)
+      self.token.check()
+      self.signals.pageReady.emit(page, [p], img)
+      return
+
+    page, strokes = self.document.streamPage(self.pageNum)
+    partial = True
+    first = True
+    batch = []
+    batchSize = self.batchSize
+    accurate = set() # layers where erasers would need to be accurate
+    for (li, k) in strokes:
+      self.token.check()
+      if not partial:
+        continue
+      if eraser_mode == AUTO_ERASER:
+        tool = rm.TOOL_ID.get(k.pen)
+        if tool == rm.ERASER_TOOL and li in accurate:
+          partial = False
+          self.signals.pageReset.emit(self.pageNum)
+          continue
+        elif needsAccurateEraser(tool, k):
+          accurate.add(li)
+      batch.append((li, k))
+      if len(batch) >= batchSize:
+        self.signals.strokesReady.emit(self.pageNum, self.batchItems(page, batch, first))
+        batch = []
+        batchSize *= 2
+        first = False
+    img = self.baseImage(page)
+    if partial:
+      items = self.batchItems(page, batch, first)
+    else:
+      items = [PageGraphicsItem(page, **self.options)]
+    self.token.check()
+    self.signals.pageReady.emit(page, items, img)
+
+  def batchItems(self, page, batch, first):
+    # One item for the highlighter strokes and one for the other strokes
+    # of each layer, stacked as they would be in a single PageGraphicsItem
+    n = len(page.layers)
+    hls = [[] for _ in range(n)]
+    inks = [[] for _ in range(n)]
+    for (li, k) in batch:
+      if rm.TOOL_ID.get(k.pen) == rm.HIGHLIGHTER_TOOL:
+        hls[li].append(k)
+      else:
+        inks[li].append(k)
+    hlBelow = self.options.get('draw_hl_below', True)
+    items = []
+    for li, l in enumerate(page.layers):
+      highlights = l.highlights if first else []
+      for z, strokes, hs in ((2 * li, hls[li], highlights), (2 * li + 1, inks[li], [])):
+        if strokes or hs:
+          layers = [Layer([], m.name, []) for m in page.layers]
+          layers[li] = Layer(strokes, l.name, hs)
+          p = PageGraphicsItem(page._replace(layers=layers), **self.options)
+          p.setZValue(z if hlBelow else 2 * li + 1)
+          items.append(p)
+    return items
+
+
+class AsyncMarkedPagesSignals(QObject):
+  markedReady = pyqtSignal(list)
+
+class AsyncMarkedPages(RenderJob):
+  """
+  Finds which of the `n` pages of `document` are marked, emitting
+  `markedReady` with their numbers in order.
+  """
+
+  def __init__(self, document, n):
+    RenderJob.__init__(self)
+    self.document = document
+    self.n = n
+    self.signals = AsyncMarkedPagesSignals()
+
+  def render(self):
+    marked = []
+    try:
+      for i in range(self.n):
+        if self.document.marked(i):
+          marked.append(i)
+    except Exception as e:
+      log.warning("Could not find the marked pages [%s]", e)
+      return
+    self.signals.markedReady.emit(marked)
+
+
+class AsyncImageSignals(QObject):
+  imageReady = pyqtSignal(int, QImage)
+  rasterReady = pyqtSignal(object, QImage)
+
+class AsyncPageRaster(QRunnable):
+  """
+  Renders a loaded page, strokes and base, to an image at `scale`.
+  The `base` image is `baseMult` times the size of the page.
+  Emits `rasterReady` with the image and the PagePainter used for it,
+  which the view reuses for the tiles.
+  """
+
+  def __init__(self, page, base, baseMult, scale, **kw):
+    QRunnable.__init__(self)
+    self.page = page
+    self.base = base
+    self.baseMult = baseMult
+    self.scale = scale
+    self.options = kw
+    self.signals = AsyncImageSignals()
 
+  def run(self):
+    try:
+      img = QImage(int(rm.WIDTH * self.scale), int(rm.HEIGHT * self.scale), QImage.Format_ARGB32_Premultiplied)
+      img.fill(Qt.white)
+      painter = QPainter(img)
+      painter.setRenderHint(QPainter.Antialiasing)
+      painter.setRenderHint(QPainter.SmoothPixmapTransform)
+      if self.base is not None and not self.base.isNull():
+        s = self.scale / self.baseMult
+        painter.drawImage(QRectF(0, 0, self.base.width() * s, self.base.height() * s), self.base)
+      pagePainter = PagePainter(self.page, **self.options)
+      pagePainter.render(painter)
+      painter.end()
+    except Exception as e:
+      log.warning("Could not render page %d [%s]", self.page.pageNum, e)
+      return
+    self.signals.rasterReady.emit(pagePainter, img)
+
+class AsyncBaseImage(QRunnable):
+  """
+  Renders the base pdf of a page at `mult` times the size of the page.
+  """
+
+  def __init__(self, document, i, mult):
+    QRunnable.__init__(self)
+    self.document = document
+    self.pageNum = i
+    self.mult = mult
+    self.signals = AsyncImageSignals()
+
+  def run(self):
+    pdf = self.document.baseDocument()
+    if pdf:
+      self.signals.imageReady.emit(self.mult, pdf.toImage(self.pageNum, 72.0 * self.mult))
 
 
 class QLoadingItem(QGraphicsRectItem):
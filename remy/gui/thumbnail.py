@@ -5,7 +5,7 @@ from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 
 import remy.remarkable.constants as rm
-from remy.remarkable.render import BarePageScene, IGNORE_ERASER
+from remy.remarkable.render import PagePainter, backgroundTemplate, IGNORE_ERASER
 
 from remy.utils import log
 
@@ -27,21 +27,20 @@ class ThumbnailWorker(QRunnable):
       d = self.index.get(self.uid)
       log.debug("Generating thumb for %s", d.name())
       page = d.getPage(d.cover())
-      s = BarePageScene(page,
-                        include_base_layer=False,
-                        pencil_resolution = 1,
-                        simplify=0, smoothen=False,
-                        eraser_mode=IGNORE_ERASER)
-      img = QImage(self.height * s.width() / s.height(), self.height ,QImage.Format_ARGB32)
+      s = PagePainter(page,
+                      include_base_layer=False,
+                      pencil_resolution = 1,
+                      simplify=0, smoothen=False,
+                      eraser_mode=IGNORE_ERASER)
+      img = QImage(int(self.height * s.width() / s.height()), self.height ,QImage.Format_ARGB32)
       img.fill(Qt.white)
       painter = QPainter(img)
       painter.setRenderHint(QPainter.Antialiasing)
       painter.setRenderHint(QPainter.SmoothPixmapTransform)
       if page.background and page.background.name != "Blank":
-        bgf = page.background.retrieve()
-        if bgf:
-          bg = QImage(bgf)
-          painter.drawImage(img.rect(), bg)
+        bg = backgroundTemplate(page.background)
+        if bg:
+          bg.draw(painter, QRectF(img.rect()))
       else:
         pdf = d.baseDocument()
         if pdf:
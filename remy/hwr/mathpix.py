@@ -8,7 +8,7 @@ from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 
 from remy.remarkable.constants import *
-from remy.remarkable.render import BarePageScene, IGNORE_ERASER
+from remy.remarkable.render import PagePainter, IGNORE_ERASER
 
 from remy.utils import log
 
@@ -35,8 +35,8 @@ class MathPixError(Exception):
 
 
 def mathpixRaster(page, app_id, app_key, scale=.5, **opt):
-  s = BarePageScene(page, **opt)
-  img = QImage(scale * WIDTH, scale * HEIGHT, QImage.Format_RGB32)
+  s = PagePainter(page, **opt)
+  img = QImage(int(scale * WIDTH), int(scale * HEIGHT), QImage.Format_RGB32)
   img.fill(Qt.white)
   painter = QPainter(img)
   painter.setRenderHint(QPainter.Antialiasing)
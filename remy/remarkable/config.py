@@ -24,6 +24,8 @@ OPTIONS_DEFAULTS = {
   "default_source": False,
   "sources": {},
   "log_verbosity": "info",
+  "memory_cache_size": 128,
+  "tile_cache_size": 64,
   "export": {
     "default_dir": "",
     "eraser_mode": "ignore",
@@ -0,0 +1,100 @@
+import os
+from collections import deque
+from itertools import islice
+from threading import RLock
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing as mp
+
+from remy.remarkable.lines import readLines, packLines, unpackLines, InvalidFormat, UnsupportedVersion
+
+from remy.utils import log
+
+
+# Runs in the worker processes: the decoded page travels back
+# in the compact format of `packLines`, which pickles as a single buffer.
+def decodeFile(path):
+  with open(path, 'rb') as f:
+    return packLines(*readLines(f))
+
+def _decodeLocal(path):
+  try:
+    with open(path, 'rb') as f:
+      return readLines(f)
+  except Exception as e:
+    return e
+
+
+class DecoderPool():
+  """
+  Decodes `.rm` files in a pool of worker processes, so that bulk
+  operations like exports use all the cores instead of one.
+  The workers are started on first use, with the `spawn` method
+  which is safe in the presence of Qt's threads.
+  Batches shorter than `min_batch` are better decoded in process,
+  as they do not pay off the cost of involving the workers.
+  """
+
+  def __init__(self, processes=None, min_batch=8):
+    self.processes = processes or os.cpu_count() or 1
+    self.min_batch = min_batch
+    self._executor = None
+    self._lock = RLock()
+
+  def _pool(self):
+    with self._lock:
+      if self._executor is None:
+        self._executor = ProcessPoolExecutor(self.processes, mp_context=mp.get_context('spawn'))
+      return self._executor
+
+  # Yields, in order, the (version, layers) of each path in `paths`,
+  # or the exception raised decoding it; `None` paths yield `None`.
+  # `paths` is consumed lazily, a few jobs per worker ahead of the results.
+  def decode(self, paths):
+    if self.processes < 2:
+      for p in paths:
+        yield None if p is None else _decodeLocal(p)
+      return
+    pool = self._pool()
+    paths = iter(paths)
+    window = deque()
+    def submit(p):
+      window.append((p, None if p is None else pool.submit(decodeFile, p)))
+    try:
+      for p in islice(paths, self.processes * 4):
+        submit(p)
+      while window:
+        p, job = window.popleft()
+        for q in islice(paths, 1):
+          submit(q)
+        if job is None:
+          yield None
+          continue
+        try:
+          r = unpackLines(job.result())
+        except (InvalidFormat, UnsupportedVersion, OSError) as e:
+          r = e
+        except Exception as e:
+          # e.g. a worker died: do not lose the page
+          log.warning("Decoding %s in the pool failed [%s]", p, e)
+          with self._lock:
+            self._executor = None
+          r = _decodeLocal(p)
+        yield r
+    finally:
+      for (_, job) in window:
+        if job is not None:
+          job.cancel()
+
+  def shutdown(self):
+    with self._lock:
+      if self._executor is not None:
+        self._executor.shutdown(wait=False)
+        self._executor = None
+
+
+_decoderPool = None
+def decoderPool(**kw):
+  global _decoderPool
+  if _decoderPool is None:
+    _decoderPool = DecoderPool(**kw)
+  return _decoderPool
@@ -5,6 +5,14 @@ from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from PyQt5.QtPrintSupport import *
 
+import os
+import json
+from hashlib import sha1
+from threading import Lock
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
 from PyPDF2 import PdfFileReader, PdfFileWriter
 from PyPDF2.generic import NullObject
 try:
@@ -14,8 +22,15 @@ except ImportError:
   from PyPDF2 import PageObject
   from PyPDF2.errors import PdfReadError
 
+# With PyMuPDF the pages are rendered in parallel and merged with the
+# base PDF in a single pass; PyPDF2 is the fallback
+try:
+  import fitz
+except ImportError:
+  fitz = None
+
 from remy.remarkable.metadata import PDFBasedDoc
-from remy.remarkable.render import BarePageScene, Palette
+from remy.remarkable.render import PagePainter, Palette
 
 from remy.utils import log
 
@@ -38,21 +53,24 @@ def _progress(p, i, t):
   if callable(p):
     p(i, t)
 
-def scenesPdf(scenes, pages, outputPath, progress=None, tot=0):
-  printer = QPrinter(QPrinter.HighResolution)
-  printer.setOutputFormat(QPrinter.PdfFormat)
-  # printer.setPageSize(QPrinter.A4)
-  printer.setOutputFileName(outputPath)
-  printer.setPaperSize(QSizeF(HEIGHT_MM,WIDTH_MM), QPrinter.Millimeter)
-  printer.setPageMargins(0,0,0,0, QPrinter.Millimeter)
-  printer.setCreator('Remy')
+def _pdfWriter(output):
+  # output is a file name or a QIODevice
+  writer = QPdfWriter(output)
+  writer.setResolution(1200) # as QPrinter.HighResolution
+  writer.setPageSize(QPageSize(QSizeF(HEIGHT_MM,WIDTH_MM), QPageSize.Millimeter))
+  writer.setPageMargins(QMarginsF(0,0,0,0), QPageLayout.Millimeter)
+  writer.setCreator('Remy')
+  return writer
+
+def scenesPdf(scenes, pages, output, progress=None, tot=0):
+  writer = _pdfWriter(output)
   p=QPainter()
-  p.begin(printer)
+  p.begin(writer)
   try:
     _progress(progress, 0, tot)
     for (i,scene) in enumerate(scenes(pages)):
       if i > 0:
-        printer.newPage()
+        writer.newPage()
       scene.render(p)
       _progress(progress, i+1, tot)
   except Exception as e:
@@ -60,6 +78,137 @@ def scenesPdf(scenes, pages, outputPath, progress=None, tot=0):
   finally:
     p.end()
 
+def scenesPdfData(scenes, pages, progress=None, tot=0):
+  buf = QBuffer()
+  buf.open(QIODevice.WriteOnly)
+  scenesPdf(scenes, pages, buf, progress=progress, tot=tot)
+  return bytes(buf.data())
+
+
+def renderedParts(scenes, pages, progress=None, tot=0, workers=None, batch=8):
+  """
+  Renders `pages` like scenesPdf, yielding in order a fitz.Document for
+  each batch of at most `batch` consecutive pages.
+  The batches are rendered by `workers` threads, only a few ahead of the
+  one consumed, so that memory does not grow with the number of pages.
+  Qt draws and writes the PDFs without holding the GIL, so this is
+  where the threads overlap; building the paths of the strokes does not.
+  """
+  pages = list(pages)
+  workers = workers or os.cpu_count() or 1
+  # small documents are still split across all the workers
+  batch = max(1, min(batch, -(-len(pages) // workers)))
+  batches = (pages[i:i+batch] for i in range(0, len(pages), batch))
+
+  lock = Lock()
+  done = 0
+  def pr(i, t):
+    # called by each batch as it completes its pages
+    nonlocal done
+    if i > 0:
+      with lock:
+        done += 1
+        i = done
+    _progress(progress, i, tot)
+
+  if workers < 2:
+    for b in batches:
+      yield fitz.open('pdf', scenesPdfData(scenes, b, pr))
+    return
+  with ThreadPoolExecutor(workers) as executor:
+    window = deque()
+    def submit(b):
+      window.append(executor.submit(scenesPdfData, scenes, b, pr))
+    try:
+      for b in islice(batches, workers * 2):
+        submit(b)
+      while window:
+        data = window.popleft().result()
+        for b in islice(batches, 1):
+          submit(b)
+        yield fitz.open('pdf', data)
+    finally:
+      # on errors or cancellation, drop the batches not yet started
+      for job in window:
+        job.cancel()
+
+
+class PdfStream():
+  """
+  Writes a PDF with PyMuPDF a chunk of pages at a time: the pages are
+  added to `document()`, which is saved every `chunk` pages (incrementally
+  after the first time) and reopened, so that the pages already written,
+  and what they copied from other documents, are not kept in memory.
+  As the document is replaced when it is saved, the result of
+  `document()` must not be kept across calls to `pageAdded` or `copyPage`.
+  """
+
+  def __init__(self, path, chunk=16):
+    self.path = path
+    self.chunk = chunk
+    self.doc = fitz.open()
+    self._saved = False
+    self._pending = 0
+    self._run = None # [doc, first page, last page, rotation] to copy
+
+  def document(self):
+    self._copyRun()
+    return self.doc
+
+  def pageAdded(self):
+    self._pending += 1
+    if self._pending >= self.chunk:
+      self._save()
+      self.doc = fitz.open(self.path)
+
+  def copyPage(self, src, pno, rotation=0):
+    # consecutive pages of the same document are copied at once,
+    # otherwise the resources they share would be copied for each;
+    # `rotation` is added to the rotation of the page
+    run = self._run
+    if run and (run[0] is not src or run[2] + 1 != pno or run[3] != rotation):
+      self._copyRun()
+    if self._run:
+      self._run[2] = pno
+    else:
+      self._run = [src, pno, pno, rotation]
+    if self._run[2] - self._run[1] + 1 >= self.chunk:
+      self._copyRun()
+
+  def _copyRun(self):
+    if self._run:
+      src, first, last, rotation = self._run
+      self._run = None
+      self.doc.insert_pdf(src, from_page=first, to_page=last)
+      if rotation:
+        for page in self.doc.pages(first - last - 1):
+          page.set_rotation((page.rotation + rotation) % 360)
+      for _ in range(first, last + 1):
+        self.pageAdded()
+
+  def _save(self):
+    if self._saved:
+      self.doc.saveIncr()
+    else:
+      self.doc.save(self.path)
+      self._saved = True
+    self.doc.close()
+    self._pending = 0
+
+  def close(self):
+    self._copyRun()
+    if self._pending or not self._saved:
+      self._save()
+    else:
+      self.doc.saveIncr() # e.g. changes to the catalog
+      self.doc.close()
+
+  def abort(self):
+    # closes the document without saving what is pending
+    self._run = None
+    if not self.doc.is_closed:
+      self.doc.close()
+
 
 def pdfrotate(outputPath, rotate=0):
   reader = PdfFileReader(outputPath, strict=False)
@@ -72,7 +221,9 @@ def pdfrotate(outputPath, rotate=0):
     writer.write(out)
 
 
-def pdfmerge(base, outputPath, pdfRanges=None, rotate=0, progress=None):
+# The pages in `passthrough` have no annotations in `outputPath`:
+# their base page is copied as it is.
+def pdfmerge(base, outputPath, pdfRanges=None, rotate=0, progress=None, passthrough=()):
   baseReader = PdfFileReader(base.path(), strict=False)
   annotReader = PdfFileReader(outputPath, strict=False)
   if pdfRanges is None:
@@ -83,9 +234,21 @@ def pdfmerge(base, outputPath, pdfRanges=None, rotate=0, progress=None):
     pdfRanges = chain(*pdfRanges)
   writer = TolerantPdfWriter()
   _progress(progress, 0, pageNum + 1)
-  for apage, page in enumerate(pdfRanges):
-    ap = annotReader.getPage(apage)
+  apage = 0
+  for page in pdfRanges:
     bpage = base.originalPageNum(page)
+    if page in passthrough:
+      bp = baseReader.getPage(bpage)
+      s = bp.cropBox or bp.artBox
+      w, h = s.upperRight[0] - s.upperLeft[0], s.upperLeft[1] - s.lowerLeft[1]
+      rot = copiedRotation(w, h, 360 - rotate)
+      if rot:
+        bp.rotateClockwise(rot)
+      writer.addPage(bp)
+      _progress(progress, page, pageNum + 1)
+      continue
+    ap = annotReader.getPage(apage)
+    apage += 1
     if bpage is None:
       writer.addPage(ap)
     else:
@@ -123,6 +286,77 @@ def pdfmerge(base, outputPath, pdfRanges=None, rotate=0, progress=None):
   _progress(progress, pageNum + 1, pageNum + 1)
 
 
+def copiedRotation(w, h, rotation=0):
+  """
+  The rotation to add to a `w`x`h` base page copied as it is, so that it
+  is oriented as if it were drawn under annotations by overlayPage
+  (or pdfmerge) with `rotation`: landscape pages are turned to fit the
+  portrait page of the tablet, then the page is rotated.
+  """
+  return (rotation + (270 if w > h else 0)) % 360
+
+
+def overlayPage(out, annot, apage, base=None, bpage=None, rotation=0):
+  """
+  Single pass counterpart of pdfmerge for one page, with PyMuPDF: appends
+  to `out` the page `apage` of `annot` drawn over the page `bpage` of
+  `base` (if any), placed like pdfmerge does, and sets its rotation.
+  Both are shown as vector XObjects, so nothing is rendered or parsed again.
+  """
+  if bpage is None:
+    out.insert_pdf(annot, from_page=apage, to_page=apage)
+    page = out[-1]
+  else:
+    ar = annot[apage].rect
+    page = out.new_page(width=ar.width, height=ar.height)
+    br = base[bpage].rect
+    w, h = br.width, br.height
+    if w <= h:
+      rot = 0
+    else:
+      w, h = h, w
+      rot = 90
+    ratio = min(ar.width / w, ar.height / h)
+    page.show_pdf_page(fitz.Rect(0, 0, w * ratio, h * ratio), base, bpage, rotate=rot)
+    page.show_pdf_page(page.rect, annot, apage)
+  if rotation:
+    page.set_rotation(rotation)
+
+
+# Incremental exports: the exports made with PyMuPDF record in the output
+# a fingerprint of each page, so that exporting again to the same file
+# only renders the pages whose fingerprint changed and copies the others.
+# Bump EXPORT_FORMAT when the rendering changes, to invalidate old exports.
+
+EXPORT_FORMAT = 2
+_EXPORT_KEY = 'RemyExport'
+
+def _jsonable(o):
+  if isinstance(o, (set, frozenset)):
+    return sorted(o, key=str)
+  if isinstance(o, Palette):
+    return o.toDict()
+  return str(o)
+
+def pageFingerprint(*parts):
+  data = json.dumps([EXPORT_FORMAT, parts], sort_keys=True, default=_jsonable)
+  return sha1(data.encode()).hexdigest()
+
+def readFingerprints(doc, uid):
+  # the fingerprints of the pages of doc, if it is an export of uid
+  try:
+    kind, value = doc.xref_get_key(doc.pdf_catalog(), _EXPORT_KEY)
+    if kind == 'string':
+      data = json.loads(value)
+      if data.get('uid') == uid and len(data['pages']) == len(doc):
+        return data['pages']
+  except Exception:
+    pass
+  return []
+
+def recordFingerprints(doc, uid, fingerprints):
+  data = json.dumps({'uid': uid, 'pages': fingerprints})
+  doc.xref_set_key(doc.pdf_catalog(), _EXPORT_KEY, fitz.get_pdf_str(data))
 
 def _pageint(i):
   i = int(i)
@@ -170,8 +404,6 @@ def parsePageRanges(whichPages, document=None):
   return [slice(*parsePageRange(s)) for s in whichPages.split(',')]
 
 
-import json
-
 def parseExcludeLayers(exclude_layers):
   return set(json.loads('[%s]' % exclude_layers))
 
@@ -197,10 +429,11 @@ class Exporter(QThread):
 
   _cancel = False
 
-  def __init__(self, filename, document, whichPages=[slice(None)], parent=None, **options):
+  def __init__(self, filename, document, whichPages=[slice(None)], parent=None, workers=None, **options):
     super().__init__(parent=parent)
     self.filename   = filename
     self.document   = document
+    self.workers    = workers
     if isinstance(whichPages, str):
       whichPages = parsePageRanges(whichPages, document)
     self.whichPages = whichPages
@@ -245,28 +478,24 @@ class Exporter(QThread):
       steps = sum(len(r) for r in ranges)
       if steps == 0:
         raise Exception("No pages to export!")
-      if pdf:
-        self.onStart.emit(steps * 3 + 1)
+
+      pages = list(chain(*ranges))
+      if fitz is None:
+        if pdf:
+          self.onStart.emit(steps * 3 + 1)
+        else:
+          self.onStart.emit(steps * 2)
+        self.onNewPhase.emit("Generating PDF of lines")
+        skip = self.passthrough(pages, pdf)
+        todo = [i for i in pages if i not in skip]
+        scenesPdf(self.genScenes, todo, self.filename, progress=self._progress, tot=steps)
+        if pdf:
+          self.onNewPhase.emit("Merging with original PDF")
+          pdfmerge(self.document.baseDocument(), self.filename, pdfRanges=ranges, rotate=90 if rot else 0, progress=self._progress, passthrough=skip)
+        elif rot:
+          pdfrotate(self.filename, 90)
       else:
-        self.onStart.emit(steps * 2)
-
-      pages = chain(*ranges)
-
-      # self.onNewPhase.emit("Rendering lines")
-      # self._progress()
-      # def pr(*a):
-      #   if self._cancel:
-      #     raise CancelledExporter("Export was cancelled")
-      # for i in pages:
-      #   scenes.append(BarePageScene(self.document.getPage(i), progress=pr, **self.options))
-      #   self._progress()
-      self.onNewPhase.emit("Generating PDF of lines")
-      scenesPdf(self.genScenes, pages, self.filename, progress=self._progress, tot=steps)
-      if pdf:
-        self.onNewPhase.emit("Merging with original PDF")
-        pdfmerge(self.document.baseDocument(), self.filename, pdfRanges=ranges, rotate=90 if rot else 0, progress=self._progress)
-      elif rot:
-        pdfrotate(self.filename, 90)
+        self.streamPdf(pages, pdf, rot)
 
       self.onSuccess.emit()
     except Exception as e:
@@ -275,10 +504,121 @@ class Exporter(QThread):
       import traceback
       traceback.print_exc()
 
+  # The export with PyMuPDF: the pages that changed since the previous
+  # export are rendered a batch at a time and merged with their base page
+  # as they come, the others are copied from the previous export, and
+  # the output is written as it grows.
+  def streamPdf(self, pages, pdf, rot):
+    fingerprints = self.fingerprints(pages, pdf, rot)
+    prev, sources = self.previousExport(fingerprints)
+    skip = self.passthrough(pages, pdf)
+    todo = [i for i, k in zip(pages, sources) if k is None and i not in skip]
+    # each page is rendered, then merged
+    self.onStart.emit(len(todo) * 2)
+    if pdf:
+      self.onNewPhase.emit("Merging lines with original PDF")
+    else:
+      self.onNewPhase.emit("Generating PDF of lines")
+    if prev is not None and sources == list(range(len(prev))):
+      # the previous export is up to date
+      prev.close()
+      return
+
+    def annotations():
+      for batch in renderedParts(self.genScenes, todo, progress=self._progress, tot=len(todo), workers=self.workers):
+        for apage in range(len(batch)):
+          yield batch, apage
+        batch.close()
+
+    base = None
+    if pdf:
+      base = fitz.open(pdf)
+      baseDocument = self.document.baseDocument()
+    # written aside, as the previous export is in use until the end
+    part = self.filename + '.part'
+    out = None
+    try:
+      annots = annotations()
+      out = PdfStream(part)
+      for i, k in zip(pages, sources):
+        if k is not None:
+          out.copyPage(prev, k)
+        elif i in skip:
+          bpage = baseDocument.originalPageNum(i)
+          br = base[bpage].rect
+          rotation = copiedRotation(br.width, br.height, 270 if rot else 0)
+          out.copyPage(base, bpage, rotation)
+        else:
+          annot, apage = next(annots)
+          if base is None:
+            overlayPage(out.document(), annot, apage, rotation=90 if rot else 0)
+          else:
+            bpage = baseDocument.originalPageNum(i)
+            # as pdfmerge, only the pages over the base PDF are rotated
+            rotation = 270 if rot and bpage is not None else 0
+            overlayPage(out.document(), annot, apage, base, bpage, rotation)
+          out.pageAdded()
+          self._progress()
+      recordFingerprints(out.document(), self.document.uid, fingerprints)
+      out.close()
+      if prev is not None:
+        prev.close()
+      os.replace(part, self.filename)
+    finally:
+      if out is not None:
+        out.abort()
+      for doc in (base, prev):
+        if doc is not None and not doc.is_closed:
+          doc.close()
+      if os.path.exists(part):
+        os.remove(part)
+
+  # The pages with nothing to draw over their base page (no lines or
+  # highlights), which are copied from the base PDF as they are
+  def passthrough(self, pages, pdf):
+    if not pdf:
+      return set()
+    base = self.document.baseDocument()
+    return {
+      i for i in pages
+      if base.originalPageNum(i) is not None and not self.document.marked(i)
+    }
+
+  def fingerprints(self, pages, pdf, rot):
+    base = self.document.baseDocument() if pdf else None
+    if base is not None:
+      st = os.stat(pdf)
+      baseSig = [st.st_mtime_ns, st.st_size]
+    return [
+      pageFingerprint(
+        self.document.pageSignature(i),
+        (baseSig, base.originalPageNum(i)) if base is not None else None,
+        rot,
+        self.options)
+      for i in pages
+    ]
+
+  # The previous export to the same file, if any, and for each page to
+  # export, its number in the previous export if it has not changed since
+  def previousExport(self, fingerprints):
+    prev = None
+    if os.path.isfile(self.filename):
+      try:
+        prev = fitz.open(self.filename)
+      except Exception:
+        pass
+    if prev is not None:
+      old = {fp: k for k, fp in enumerate(readFingerprints(prev, self.document.uid))}
+      sources = [old.get(fp) for fp in fingerprints]
+      if any(k is not None for k in sources):
+        return prev, sources
+      prev.close()
+    return None, [None] * len(fingerprints)
+
   def genScenes(self, pages):
     def pr(*a):
       if self._cancel:
         raise CancelledExporter("Export was cancelled")
     # ---
-    for i in pages:
-      yield BarePageScene(self.document.getPage(i), progress=pr, **self.options)
+    for page in self.document.getPages(pages):
+      yield PagePainter(page, progress=pr, **self.options)
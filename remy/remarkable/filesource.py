@@ -9,6 +9,8 @@ from shutil import which
 from pathlib import PurePosixPath
 from threading import RLock
 
+from remy.remarkable.pagecache import PageCache
+
 from remy.utils import log
 
 
@@ -19,6 +21,9 @@ class FileSource():
   Should guarantee thread safety if used on disjoint paths.
   """
 
+  # A PageCache of decoded pages, if the source keeps one
+  pageCache = None
+
   def isReadOnly(self):
     """Don't try uploading if it is readOnly!"""
     return True
@@ -179,7 +184,7 @@ class LiveFileSourceSSH(FileSource):
 
   _dirty = False
 
-  def __init__(self, ssh, id='', name="SSH", cache_dir=None, username=None, remote_documents=None, remote_templates=None, use_banner=False, connect=True, utils_path='$HOME', persist_cache=True, **kw):
+  def __init__(self, ssh, id='', name="SSH", cache_dir=None, username=None, remote_documents=None, remote_templates=None, use_banner=False, connect=True, utils_path='$HOME', persist_cache=True, page_cache_size=256, **kw):
     self.ssh = ssh
     self.name = name
     self.persist_cache = persist_cache
@@ -193,6 +198,8 @@ class LiveFileSourceSSH(FileSource):
       log.debug("Clearing cache")
       shutil.rmtree(cache_dir, ignore_errors=True)
     self._makeLocalPaths()
+    if page_cache_size:
+      self.pageCache = PageCache(path.join(cache_dir, 'pages'), page_cache_size * 2**20)
 
     _,out,_ = self.ssh.exec_command("echo $HOME")
     out.channel.recv_exit_status()
@@ -281,10 +288,21 @@ class LiveFileSourceSSH(FileSource):
         # There is always the option of setting persist_cache: false
         # for the source
       if force or not found:
-        self.scp.get(remp, cachep)
+        self._download(remp, cachep)
         os.utime(cachep, (rstat.st_atime, rstat.st_mtime))
     return cachep
 
+  def _download(self, remp, cachep):
+    # The cached file is replaced, not rewritten in place,
+    # so that pages still mapped from it (see mapLines) stay valid
+    tmp = cachep + '.part'
+    try:
+      self.scp.get(remp, tmp)
+      os.replace(tmp, cachep)
+    finally:
+      if path.exists(tmp):
+        os.remove(tmp)
+
   def retrieveTemplate(self, name, progress=None, force=False, preferVector=False):
     try:
       filename = self._selectTemplate(name, preferVector)
@@ -292,7 +310,7 @@ class LiveFileSourceSSH(FileSource):
         cachep = self._local(filename, branch=TEMPLDIR)
         if force or not path.isfile(cachep):
           remp = self._remote(filename, branch=TEMPLDIR)
-          self.scp.get(remp, cachep)
+          self._download(remp, cachep)
       return cachep
     except Exception:
       log.warning("The template '%s' could not be loaded", name)
@@ -420,10 +438,11 @@ class LiveFileSourceRsync(LiveFileSourceSSH):
   def __init__(self, ssh, data_dir, name="Rsync",
                username="root", host="10.11.99.1", key=None,
                rsync_path=None, rsync_options=None, remote_documents=None, remote_templates=None,
-               use_banner=False, cache_mode="on_demand", known_hosts=None, host_key_policy="ask", **kw):
+               use_banner=False, cache_mode="on_demand", known_hosts=None, host_key_policy="ask",
+               page_cache_size=256, **kw):
     LiveFileSourceSSH.__init__(self, ssh, name=name, cache_dir=data_dir,
                                remote_documents=remote_documents, remote_templates=remote_templates,
-                               use_banner=use_banner, connect=False)
+                               use_banner=use_banner, connect=False, page_cache_size=page_cache_size)
 
     log.info("DATA STORED IN:\n\t%s\n\t%s", self.local_roots[0], self.local_roots[1])
 
@@ -5,6 +5,18 @@ from remy.remarkable.constants import *
 
 import json
 import os.path
+import mmap
+import sys
+from array import array
+from collections import defaultdict
+from math import pi
+
+# numpy is optional: when available, segments are views on the file's
+# buffer, otherwise they are copied into compact float arrays.
+try:
+  import numpy as np
+except ImportError:
+  np = None
 
 
 Layer = namedtuple('Layer', ['strokes', 'name', 'highlights'])
@@ -17,6 +29,11 @@ Segment = namedtuple(
   'Segment',
   ['x', 'y', 'speed', 'direction', 'width', 'pressure']
 )
+# Stroke metadata as stored in the file: `count` segments start at `offset`
+StrokeHeader = namedtuple(
+  'StrokeHeader',
+  ['pen', 'color', 'unk1', 'width', 'unk2', 'count', 'offset']
+)
 
 HEADER_START = b'reMarkable .lines file, version='
 S_HEADER_PAGE = struct.Struct('<{}ss10s'.format(len(HEADER_START)))
@@ -25,6 +42,12 @@ S_LAYER = struct.Struct('<I')
 S_STROKE_V3 = struct.Struct('<IIIfI')
 S_STROKE_V5 = struct.Struct('<IIIfII')
 S_SEGMENT = struct.Struct('<ffffff')
+S_SEGMENT_WIDTH = struct.Struct('<f')
+
+if np is not None:
+  SEGMENT_DTYPE = np.dtype([(f, '<f4') for f in Segment._fields])
+else:
+  SEGMENT_DTYPE = None
 
 
 class UnsupportedVersion(Exception):
@@ -32,6 +55,138 @@ class UnsupportedVersion(Exception):
 class InvalidFormat(Exception):
   pass
 
+
+class Segments:
+  """
+  Read-only sequence of `Segment`s backed by a structured numpy array.
+  Indexing and iteration produce `Segment` tuples, so code written for
+  lists of segments keeps working; vectorised code can use `array`
+  or `column` directly.
+  """
+
+  __slots__ = ('array',)
+
+  def __init__(self, array):
+    self.array = array
+
+  def __len__(self):
+    return len(self.array)
+
+  def __iter__(self):
+    return map(Segment._make, self.array.tolist())
+
+  def __getitem__(self, i):
+    if isinstance(i, slice):
+      return Segments(self.array[i])
+    return Segment._make(self.array[i].tolist())
+
+  def column(self, name):
+    return self.array[name]
+
+  def tobytes(self):
+    return self.array.tobytes()
+
+
+class CompactSegments:
+  """
+  Same interface as `Segments`, without numpy: the six fields of
+  every segment are interleaved in a single `array('f')`, so a stroke
+  costs one buffer instead of a tuple and six floats per point.
+  """
+
+  __slots__ = ('data',)
+
+  FIELDS = len(Segment._fields)
+
+  def __init__(self, data):
+    self.data = data
+
+  @classmethod
+  def frombuffer(cls, buff, offset=0, count=-1):
+    if count < 0:
+      count = (len(buff) - offset) // S_SEGMENT.size
+    data = array('f')
+    data.frombytes(buff[offset:offset + count * S_SEGMENT.size])
+    if sys.byteorder == 'big':
+      data.byteswap()
+    return cls(data)
+
+  def __len__(self):
+    return len(self.data) // self.FIELDS
+
+  def __iter__(self):
+    it = iter(self.data)
+    return map(Segment._make, zip(*[it] * self.FIELDS))
+
+  def __getitem__(self, i):
+    F = self.FIELDS
+    if isinstance(i, slice):
+      start, stop, step = i.indices(len(self))
+      if step == 1:
+        return CompactSegments(self.data[start * F:max(start, stop) * F])
+      return [self[j] for j in range(start, stop, step)]
+    if i < 0:
+      i += len(self)
+    if not 0 <= i < len(self):
+      raise IndexError("segment index out of range")
+    return Segment._make(self.data[i * F:(i + 1) * F])
+
+  def column(self, name):
+    return self.data[Segment._fields.index(name)::self.FIELDS]
+
+  def tobytes(self):
+    if sys.byteorder == 'big':
+      data = array('f', self.data)
+      data.byteswap()
+      return data.tobytes()
+    return self.data.tobytes()
+
+
+class MappedSegments:
+  """
+  Lazy view of `count` segments stored at `offset` in `data`
+  (typically a memory-mapped `.rm` file).
+  Nothing is decoded until the segments are iterated or indexed.
+  """
+
+  __slots__ = ('data', 'offset', 'count')
+
+  def __init__(self, data, offset, count):
+    self.data = data
+    self.offset = offset
+    self.count = count
+
+  def __len__(self):
+    return self.count
+
+  def decode(self):
+    return _segmentsOf(self.data, self.offset, self.count)
+
+  def __iter__(self):
+    return iter(self.decode())
+
+  def __getitem__(self, i):
+    if isinstance(i, slice):
+      return self.decode()[i]
+    if i < 0:
+      i += self.count
+    if not 0 <= i < self.count:
+      raise IndexError("segment index out of range")
+    return Segment._make(S_SEGMENT.unpack_from(self.data, self.offset + i * S_SEGMENT.size))
+
+  def column(self, name):
+    return self.decode().column(name)
+
+  def tobytes(self):
+    return bytes(self.data[self.offset:self.offset + self.count * S_SEGMENT.size])
+
+
+def _segmentsOf(data, offset, count):
+  if np is not None:
+    return Segments(np.frombuffer(data, SEGMENT_DTYPE, count=count, offset=offset))
+  return CompactSegments.frombuffer(data, offset, count)
+
+
 def readStruct(fmt, source):
   buff = source.read(fmt.size)
   return fmt.unpack(buff)
@@ -43,14 +198,470 @@ def readStroke3(source):
 def readStroke5(source):
   return readStruct(S_STROKE_V5, source)
 
+def _strokeFormat(ver):
+  if ver == 3:
+    return S_STROKE_V3
+  elif ver == 5:
+    return S_STROKE_V5
+  raise UnsupportedVersion("Remy supports notebooks in the version 3, 5 and 6 format only")
+
+def _readVersion(header):
+  header, ver, *_ = header
+  if not header.startswith(HEADER_START):
+    raise InvalidFormat("Header is invalid")
+  return int(ver)
+
+
 # source is a filedescriptor from which we can .read(N)
 def readLines(source):
+  return decodeLines(source.read())
+
+# Walks the layout of a page recording the header of each stroke,
+# seeking over the segments without reading them.
+# `source` can be a file or an mmap, as long as it supports seek.
+def readHeaders(source):
   try:
 
-    header, ver, *_ = readStruct(S_HEADER_PAGE, source)
-    if not header.startswith(HEADER_START):
-      raise InvalidFormat("Header is invalid")
-    ver = int(ver)
+    ver = _readVersion(readStruct(S_HEADER_PAGE, source))
+    if ver == 6:
+      source.seek(0)
+      return readHeadersV6(source.read())
+    S_STROKE = _strokeFormat(ver)
+    n_layers, _, _ = readStruct(S_PAGE, source)
+    layers = []
+    for l in range(n_layers):
+      n_strokes, = readStruct(S_LAYER, source)
+      strokes = []
+      for s in range(n_strokes):
+        pen, color, unk1, width, *unk2, n_segments = readStruct(S_STROKE, source)
+        offset = source.tell()
+        strokes.append(StrokeHeader(pen, color, unk1, width, unk2[0] if unk2 else 0, n_segments, offset))
+        source.seek(n_segments * S_SEGMENT.size, os.SEEK_CUR)
+      layers.append(strokes)
+
+    return (ver, layers)
+
+  except (struct.error, ValueError):
+    raise InvalidFormat("Error while reading page")
+
+# Maps the page at `path` in memory and decodes only the stroke headers;
+# each stroke's segments are a `MappedSegments` view into the mapping.
+# The mapping lasts as long as the strokes, so the file must be replaced
+# rather than rewritten in place while they are in use.
+def mapLines(path):
+  with open(path, 'rb') as f:
+    try:
+      data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+      raise InvalidFormat("Empty page")
+  if data[len(HEADER_START):len(HEADER_START) + 1] == b'6':
+    # points are converted anyway, nothing to gain from lazy views
+    return decodeLinesV6(data)
+  ver, headers = readHeaders(data)
+  try:
+    layers = [[_mappedStroke(data, h) for h in l] for l in headers]
+  except struct.error:
+    raise InvalidFormat("Error while reading page")
+  return (ver, layers)
+
+def _mappedStroke(data, h):
+  width = h.width
+  if h.count > 0:
+    # see decodeLines
+    end = h.offset + h.count * S_SEGMENT.size
+    width, = S_SEGMENT_WIDTH.unpack_from(data, end - S_SEGMENT_WIDTH.size * 2)
+  return Stroke(h.pen, h.color, h.unk1, width, h.unk2, MappedSegments(data, h.offset, h.count))
+
+# Decodes a whole page from a bytes-like object.
+# Headers are unpacked in place and each stroke's segments
+# become a view on `data` (or a compact copy without numpy),
+# with no per-point Python objects.
+def decodeLines(data):
+  try:
+
+    ver = _readVersion(S_HEADER_PAGE.unpack_from(data, 0))
+    if ver == 6:
+      return decodeLinesV6(data)
+    S_STROKE = _strokeFormat(ver)
+    offset = S_HEADER_PAGE.size
+    n_layers, _, _ = S_PAGE.unpack_from(data, offset)
+    offset += S_PAGE.size
+    layers = []
+    for l in range(n_layers):
+      n_strokes, = S_LAYER.unpack_from(data, offset)
+      offset += S_LAYER.size
+      strokes = []
+      for s in range(n_strokes):
+        pen, color, unk1, width, *unk2, n_segments = S_STROKE.unpack_from(data, offset)
+        offset += S_STROKE.size
+        segments = _segmentsOf(data, offset, n_segments)
+        if len(segments) < n_segments:
+          raise InvalidFormat("Error while reading page")
+        offset += n_segments * S_SEGMENT.size
+        if n_segments > 0:
+          # the legacy parser reports the width of the last segment
+          # and the renderer relies on it (e.g. for erasers)
+          width, = S_SEGMENT_WIDTH.unpack_from(data, offset - S_SEGMENT_WIDTH.size * 2)
+        strokes.append(Stroke(pen, color, unk1, width, unk2[0] if unk2 else 0, segments))
+      layers.append(strokes)
+
+    return (ver, layers)
+
+  except (struct.error, ValueError):
+    raise InvalidFormat("Error while reading page")
+
+# Generator-based variant of readLines, for progressive display.
+# Returns the version and the names of the layers right away
+# (None when the file does not record them), together with
+# a generator of (layer index, stroke) pairs, which reads and decodes
+# the strokes from `source` one by one as it is iterated.
+def streamLines(source):
+  try:
+    header = readStruct(S_HEADER_PAGE, source)
+    ver = _readVersion(header)
+    if ver == 6:
+      return streamLinesV6(S_HEADER_PAGE.pack(*header) + source.read())
+    S_STROKE = _strokeFormat(ver)
+    n_layers, _, _ = readStruct(S_PAGE, source)
+  except struct.error:
+    raise InvalidFormat("Error while reading page")
+  return (ver, [None] * n_layers, _streamStrokes(source, S_STROKE, n_layers))
+
+def _streamStrokes(source, S_STROKE, n_layers):
+  try:
+
+    for l in range(n_layers):
+      n_strokes, = readStruct(S_LAYER, source)
+      for s in range(n_strokes):
+        pen, color, unk1, width, *unk2, n_segments = readStruct(S_STROKE, source)
+        data = source.read(n_segments * S_SEGMENT.size)
+        segments = _segmentsOf(data, 0, n_segments)
+        if len(segments) < n_segments:
+          raise InvalidFormat("Error while reading page")
+        if n_segments > 0:
+          # see decodeLines
+          width, = S_SEGMENT_WIDTH.unpack_from(data, len(data) - S_SEGMENT_WIDTH.size * 2)
+        yield (l, Stroke(pen, color, unk1, width, unk2[0] if unk2 else 0, segments))
+
+  except (struct.error, ValueError):
+    raise InvalidFormat("Error while reading page")
+
+
+# VERSION 6
+#
+# Pages written by version 3 of the reMarkable software are a sequence of
+# tagged blocks encoding a CRDT scene tree: layers are the tree nodes
+# children of the root, and strokes are line items within them.
+# The blocks are indexed in one pass reading only their headers; then only
+# tree nodes, group items and line items are decoded, and the points
+# of a line only when its stroke is needed.
+
+S_BLOCK_HEADER = struct.Struct('<IBBBB') # length, unknown, min version, version, type
+S_POINT_V1 = S_SEGMENT
+S_POINT_V2 = struct.Struct('<ffHHBB') # x, y, speed, width, direction, pressure
+S_U32 = struct.Struct('<I')
+S_F32 = struct.Struct('<f')
+S_F64 = struct.Struct('<d')
+
+BLOCK_TREE_NODE = 0x02
+BLOCK_GROUP_ITEM = 0x04
+BLOCK_LINE_ITEM = 0x05
+
+TAG_ID = 0xF
+TAG_LENGTH4 = 0xC
+TAG_BYTE8 = 0x8
+TAG_BYTE4 = 0x4
+TAG_BYTE1 = 0x1
+
+ROOT_NODE = (0, 1)
+END_MARKER = (0, 0)
+# sentinels for the ends of CRDT sequences
+_SEQ_START = (-1, 0)
+_SEQ_END = (-1, 1)
+
+if np is not None:
+  POINT_V2_DTYPE = np.dtype([
+    ('x', '<f4'), ('y', '<f4'), ('speed', '<u2'),
+    ('width', '<u2'), ('direction', 'u1'), ('pressure', 'u1')
+  ])
+
+
+# Type, version, start and end of the body of each block
+def indexBlocks(data):
+  blocks = []
+  offset = S_HEADER_PAGE.size
+  while offset < len(data):
+    length, _, _, ver, btype = S_BLOCK_HEADER.unpack_from(data, offset)
+    start = offset + S_BLOCK_HEADER.size
+    offset = start + length
+    if offset > len(data):
+      raise InvalidFormat("Truncated block")
+    blocks.append((btype, ver, start, offset))
+  return blocks
+
+
+class TaggedReader:
+  """
+  Reads the tagged values in `data[pos:end]`.
+  Each value is preceded by a varuint tag `index << 4 | type`,
+  which is checked against the expected one.
+  """
+
+  __slots__ = ('data', 'pos', 'end')
+
+  def __init__(self, data, pos, end):
+    self.data = data
+    self.pos = pos
+    self.end = end
+
+  def varuint(self):
+    result = shift = 0
+    while True:
+      b = self.data[self.pos]
+      self.pos += 1
+      result |= (b & 0x7F) << shift
+      if b < 0x80:
+        return result
+      shift += 7
+
+  def has(self, index, ttype):
+    if self.pos >= self.end:
+      return False
+    pos = self.pos
+    tag = self.varuint()
+    self.pos = pos
+    return tag == (index << 4) | ttype
+
+  def tag(self, index, ttype):
+    if not self.has(index, ttype):
+      raise InvalidFormat("Unexpected tag in block")
+    self.varuint()
+
+  def _unpack(self, fmt):
+    v, = fmt.unpack_from(self.data, self.pos)
+    self.pos += fmt.size
+    return v
+
+  def id(self, index):
+    self.tag(index, TAG_ID)
+    part1 = self.data[self.pos]
+    self.pos += 1
+    return (part1, self.varuint())
+
+  def uint(self, index):
+    self.tag(index, TAG_BYTE4)
+    return self._unpack(S_U32)
+
+  def float(self, index):
+    self.tag(index, TAG_BYTE4)
+    return self._unpack(S_F32)
+
+  def double(self, index):
+    self.tag(index, TAG_BYTE8)
+    return self._unpack(S_F64)
+
+  def bool(self, index):
+    self.tag(index, TAG_BYTE1)
+    self.pos += 1
+    return self.data[self.pos - 1] != 0
+
+  # Returns the end of the subblock, its contents start at `pos`
+  def subblock(self, index):
+    self.tag(index, TAG_LENGTH4)
+    length = self._unpack(S_U32)
+    return self.pos + length
+
+  def string(self, index):
+    end = self.subblock(index)
+    length = self.varuint()
+    self.pos += 1 # is_ascii flag
+    s = bytes(self.data[self.pos:self.pos + length]).decode('utf-8')
+    self.pos = end
+    return s
+
+
+# Sorts the items of a CRDT sequence, given as {id: (left id, right id, value)}:
+# each item comes after its left and before its right neighbour,
+# concurrent insertions are ordered by id.
+def crdtOrder(items):
+  succ = defaultdict(list)
+  indeg = defaultdict(int)
+  for i, (left, right, _) in items.items():
+    left = _SEQ_START if left == END_MARKER else left
+    right = _SEQ_END if right == END_MARKER else right
+    succ[left].append(i)
+    indeg[i] += 1
+    succ[i].append(right)
+    indeg[right] += 1
+  ready = sorted(n for n in set(succ) | set(indeg) if indeg[n] == 0)
+  order = []
+  while ready:
+    following = []
+    for n in ready:
+      if n in items:
+        order.append(n)
+      for m in succ[n]:
+        indeg[m] -= 1
+        if indeg[m] == 0:
+          following.append(m)
+    ready = sorted(following)
+  if len(order) < len(items):
+    # inconsistent sequence, better out of order than lost
+    seen = set(order)
+    order += [i for i in items if i not in seen]
+  return order
+
+
+# Layers of a v6 page, as (name, visible, lines) where `lines` are
+# references (block version, start, end) to the values of line items
+def _sceneLayers(data):
+  nodes = {} # node id -> (label, visible)
+  children = defaultdict(dict) # node id -> {item id: (left, right, value)}
+
+  for (btype, ver, start, end) in indexBlocks(data):
+    if btype == BLOCK_TREE_NODE:
+      r = TaggedReader(data, start, end)
+      node = r.id(1)
+      label, visible = None, True
+      if r.has(2, TAG_LENGTH4):
+        e = r.subblock(2)
+        r.id(1)
+        label = r.string(2)
+        r.pos = e
+      if r.has(3, TAG_LENGTH4):
+        e = r.subblock(3)
+        r.id(1)
+        visible = r.bool(2)
+        r.pos = e
+      nodes[node] = (label, visible)
+    elif btype == BLOCK_GROUP_ITEM or btype == BLOCK_LINE_ITEM:
+      r = TaggedReader(data, start, end)
+      parent = r.id(1)
+      item = r.id(2)
+      left = r.id(3)
+      right = r.id(4)
+      r.uint(5) # deleted length
+      value = None
+      if r.has(6, TAG_LENGTH4):
+        e = r.subblock(6)
+        r.pos += 1 # item type
+        if btype == BLOCK_GROUP_ITEM:
+          value = (BLOCK_GROUP_ITEM, r.id(2))
+        else:
+          value = (BLOCK_LINE_ITEM, (ver, r.pos, e))
+      children[parent][item] = (left, right, value)
+
+  def lines(node):
+    items = children.get(node, {})
+    for i in crdtOrder(items):
+      value = items[i][2]
+      if value is None:
+        continue # deleted
+      kind, v = value
+      if kind == BLOCK_LINE_ITEM:
+        yield v
+      elif nodes.get(v, (None, True))[1]:
+        yield from lines(v)
+
+  layers = []
+  root = children.get(ROOT_NODE, {})
+  for i in crdtOrder(root):
+    value = root[i][2]
+    if value is not None and value[0] == BLOCK_GROUP_ITEM:
+      name, visible = nodes.get(value[1], (None, True))
+      layers.append((name, visible, lines(value[1])))
+  return layers
+
+def _lineHeader(data, line):
+  ver, start, end = line
+  r = TaggedReader(data, start, end)
+  tool = r.uint(1)
+  color = r.uint(2)
+  thickness = r.double(3)
+  r.float(4) # starting length
+  pend = r.subblock(5)
+  size = S_POINT_V1.size if ver < 2 else S_POINT_V2.size
+  return StrokeHeader(tool, color, 0, thickness, 0, (pend - r.pos) // size, r.pos)
+
+def _lineStroke(data, line):
+  h = _lineHeader(data, line)
+  segments = _segmentsV6(data, h.offset, h.count, line[0])
+  width = segments[-1].width if h.count > 0 else h.width # see decodeLines
+  return Stroke(h.pen, h.color, h.unk1, width, h.unk2, segments)
+
+# Points are converted to the v5 units, x being relative to the centre of the page
+def _segmentsV6(data, offset, count, ver):
+  dx = WIDTH / 2
+  if np is not None:
+    a = np.empty(count, SEGMENT_DTYPE)
+    if ver < 2:
+      p = np.frombuffer(data, SEGMENT_DTYPE, count=count, offset=offset)
+      a[:] = p
+      a['x'] += dx
+    else:
+      p = np.frombuffer(data, POINT_V2_DTYPE, count=count, offset=offset)
+      a['x'] = p['x'] + dx
+      a['y'] = p['y']
+      a['speed'] = p['speed'] / 4
+      a['direction'] = p['direction'] * (2 * pi / 255)
+      a['width'] = p['width'] / 4
+      a['pressure'] = p['pressure'] / 255
+    return Segments(a)
+  if ver < 2:
+    segments = CompactSegments.frombuffer(data, offset, count)
+    segments.data[0::6] = array('f', (x + dx for x in segments.data[0::6]))
+    return segments
+  points = memoryview(data)[offset:offset + count * S_POINT_V2.size]
+  out = array('f')
+  for (x, y, speed, width, direction, pressure) in S_POINT_V2.iter_unpack(points):
+    out.extend((x + dx, y, speed / 4, direction * (2 * pi / 255), width / 4, pressure / 255))
+  return CompactSegments(out)
+
+# Decodes a v6 page; layers are returned as `Layer`s, so to carry their names.
+# The strokes of hidden layers are not decoded.
+def decodeLinesV6(data):
+  try:
+    layers = [
+      Layer([_lineStroke(data, k) for k in lines] if visible else [], name, [])
+      for (name, visible, lines) in _sceneLayers(data)
+    ]
+    return (6, layers)
+  except (struct.error, ValueError, IndexError):
+    raise InvalidFormat("Error while reading page")
+
+def readHeadersV6(data):
+  try:
+    layers = [
+      [_lineHeader(data, k) for k in lines] if visible else []
+      for (name, visible, lines) in _sceneLayers(data)
+    ]
+    return (6, layers)
+  except (struct.error, ValueError, IndexError):
+    raise InvalidFormat("Error while reading page")
+
+def streamLinesV6(data):
+  try:
+    layers = _sceneLayers(data)
+  except (struct.error, ValueError, IndexError):
+    raise InvalidFormat("Error while reading page")
+  return (6, [name for (name, _, _) in layers], _streamStrokesV6(data, layers))
+
+def _streamStrokesV6(data, layers):
+  try:
+    for l, (name, visible, lines) in enumerate(layers):
+      if visible:
+        for k in lines:
+          yield (l, _lineStroke(data, k))
+  except (struct.error, ValueError, IndexError):
+    raise InvalidFormat("Error while reading page")
+
+
+# Original streaming parser, one struct at a time,
+# producing a namedtuple per segment.
+def readLinesLegacy(source):
+  try:
+
+    ver = _readVersion(readStruct(S_HEADER_PAGE, source))
     if ver == 3:
       readStroke = readStroke3
     elif ver == 5:
@@ -75,3 +686,76 @@ def readLines(source):
 
   except struct.error:
     raise InvalidFormat("Error while reading page")
+
+
+# Compact serialisation of decoded pages, used to store them in caches:
+# a header, the number of strokes and the name of each layer,
+# a table of stroke headers and then all the segments,
+# ready to be viewed without parsing.
+# Layers can be given as lists of strokes or, to record their names, as `Layer`s.
+PACK_MAGIC = b'RemyPg02'
+S_PACK_HEADER = struct.Struct('<8sII')
+S_PACK_STROKE = S_STROKE_V5
+S_PACK_NAME = struct.Struct('<H')
+NO_NAME = 0xFFFF
+
+def _segmentsBytes(segments):
+  if hasattr(segments, 'tobytes'):
+    return segments.tobytes()
+  return b''.join(S_SEGMENT.pack(*s) for s in segments)
+
+def packLines(ver, layers):
+  names = [l.name if isinstance(l, Layer) else None for l in layers]
+  layers = [l.strokes if isinstance(l, Layer) else l for l in layers]
+  strokes = [k for l in layers for k in l]
+  out = [S_PACK_HEADER.pack(PACK_MAGIC, ver, len(layers))]
+  out.append(struct.pack('<%dI' % len(layers), *(len(l) for l in layers)))
+  for name in names:
+    if name is None:
+      out.append(S_PACK_NAME.pack(NO_NAME))
+    else:
+      name = name.encode('utf-8')[:NO_NAME - 1]
+      out += [S_PACK_NAME.pack(len(name)), name]
+  out += [S_PACK_STROKE.pack(k.pen, k.color, k.unk1, k.width, k.unk2, len(k.segments)) for k in strokes]
+  out += [_segmentsBytes(k.segments) for k in strokes]
+  return b''.join(out)
+
+def unpackLines(data):
+  try:
+
+    magic, ver, n_layers = S_PACK_HEADER.unpack_from(data, 0)
+    if magic != PACK_MAGIC:
+      raise InvalidFormat("Not a packed page")
+    offset = S_PACK_HEADER.size
+    counts = struct.unpack_from('<%dI' % n_layers, data, offset)
+    offset += 4 * n_layers
+    names = []
+    for l in range(n_layers):
+      n, = S_PACK_NAME.unpack_from(data, offset)
+      offset += S_PACK_NAME.size
+      if n == NO_NAME:
+        names.append(None)
+      else:
+        names.append(bytes(data[offset:offset + n]).decode('utf-8'))
+        offset += n
+    total = sum(counts)
+    table = memoryview(data)[offset:offset + total * S_PACK_STROKE.size]
+    headers = S_PACK_STROKE.iter_unpack(table)
+    offset += total * S_PACK_STROKE.size
+    layers = []
+    for n_strokes in counts:
+      strokes = []
+      for s in range(n_strokes):
+        pen, color, unk1, width, unk2, n_segments = next(headers)
+        segments = _segmentsOf(data, offset, n_segments)
+        if len(segments) < n_segments:
+          raise InvalidFormat("Truncated packed page")
+        offset += n_segments * S_SEGMENT.size
+        strokes.append(Stroke(pen, color, unk1, width, unk2, segments))
+      layers.append(strokes)
+
+    layers = [l if name is None else Layer(l, name, []) for l, name in zip(layers, names)]
+    return (ver, layers)
+
+  except (struct.error, ValueError, StopIteration):
+    raise InvalidFormat("Error while reading packed page")
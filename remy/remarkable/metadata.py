@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import json
 from itertools import *
-from collections import namedtuple
+from collections import namedtuple, deque
 import arrow
 import uuid
 
@@ -11,7 +11,8 @@ from pathlib import Path
 from remy.remarkable.lines import *
 from remy.remarkable.constants import *
 from remy.remarkable.pdfbase import PDFBase
-from remy.utils import deepupdate
+from remy.remarkable.decoder import decoderPool
+from remy.utils import deepupdate, LRUCache
 from copy import deepcopy
 
 from threading import RLock
@@ -274,47 +275,217 @@ class TrashBin(Folder):
 
 class Document(Entry):
 
+  def __getattr__(self, field):
+    if field == "pages" and "pages" not in self._content and "cPages" in self._content:
+      # the content files of version 3 of the software list the pages in cPages
+      return [
+        p["id"] for p in self._content["cPages"].get("pages", [])
+        if not p.get("deleted", {}).get("value")
+      ]
+    return Entry.__getattr__(self, field)
+
   def getPageId(self, pageNum):
     if self.pages is None:
       return str(pageNum)
     else:
       return self.pages[pageNum]
 
-  def getPage(self, pageNum, force=False):
-    pages = self.pages
+  # With `mapped` the page file is memory-mapped and the segments
+  # of each stroke are only decoded when they are used.
+  # Decoded pages are kept in the index's page cache,
+  # `force` bypasses it and retrieves the page again.
+  def getPage(self, pageNum, force=False, mapped=False):
     try:
       pid = self.getPageId(pageNum)
       rmfile = self.fsource.retrieve(self.uid, pid, ext='rm', force=force)
-      with open(rmfile, 'rb') as f:
-        (ver, layers) = readLines(f)
     except:
-      ver = 5
-      layers = []
-    else:
-      try:
-        mfile = self.fsource.retrieve(self.uid, pid + '-metadata', ext='json')
-        with open(mfile, 'r') as f:
-          layerNames = json.load(f)
-        layerNames = layerNames["layers"]
-      except Exception:
-        layerNames = [{"name": "Layer %d" % j} for j in range(len(layers))]
+      return self._makePage([], 5, pageNum)
+    cache = self.index.pageCache
+    key = self._pageKey(pageNum, pid, rmfile)
+    if cache is not None and not force:
+      page = cache.get(key)
+      if page is not None:
+        return page
+    page = self._loadPage(pageNum, pid, rmfile, mapped=mapped)
+    if cache is not None and not mapped:
+      cache.put(key, page)
+    return page
+
+  # Key of a page in the index's page cache: as in the disk cache,
+  # the modification time and size of the page file are part of it,
+  # so that a page which changed on disk is read again
+  def _pageKey(self, pageNum, pid, rmfile):
+    try:
+      # some sources return no path for a missing file
+      st = stat(rmfile)
+      return (self.uid, pageNum, pid, st.st_mtime_ns, st.st_size)
+    except (OSError, TypeError):
+      return (self.uid, pageNum, pid, None, None) # an unannotated page
 
-      highlights = {}
-      try:
-        if self.fsource.exists(self.uid + '.highlights', pid, ext='json'):
-          hfile = self.fsource.retrieve(self.uid + '.highlights', pid, ext='json')
-          with open(hfile, 'r') as f:
-            h = json.load(f).get('highlights', [])
-          for i in range(len(h)):
-            highlights[i] = h[i]
-      except Exception:
-        pass # empty highlights are ok
+  def _loadPage(self, pageNum, pid, rmfile, mapped=False):
+    try:
+      if mapped:
+        (ver, layers) = mapLines(rmfile)
+      else:
+        (ver, layers) = self._readPage(pid, rmfile)
+    except:
+      return self._makePage([], 5, pageNum)
 
-      for j in range(len(layers)):
-        layers[j] = Layer(layers[j], layerNames[j].get("name"), highlights.get(j, []))
+    return self._finishPage(pageNum, pid, ver, layers)
 
+  def _finishPage(self, pageNum, pid, ver, layers):
+    layerInfo = self._layerInfo(pid, len(layers))
+    layers = [self._layer(l, *info) for l, info in zip(layers, layerInfo)]
     return self._makePage(layers, ver, pageNum)
 
+  # Generator of the pages `pageNums`, in order, for bulk operations:
+  # the pages which are not cached are decoded in parallel by `pool`
+  # (by default the shared decoder pool).
+  def getPages(self, pageNums, pool=None):
+    pageNums = list(pageNums)
+    pool = pool or decoderPool()
+    if len(pageNums) < pool.min_batch:
+      for i in pageNums:
+        yield self.getPage(i)
+      return
+    cache = self.index.pageCache
+    pcache = self.fsource.pageCache
+    pending = deque() # (pageNum, page or (pid, rmfile)) in order
+
+    def paths():
+      for i in pageNums:
+        try:
+          pid = self.getPageId(i)
+          rmfile = self.fsource.retrieve(self.uid, pid, ext='rm')
+        except Exception:
+          pending.append((i, None, self._makePage([], 5, i)))
+          yield None
+          continue
+        key = self._pageKey(i, pid, rmfile)
+        page = cache.get(key) if cache is not None else None
+        if page is None:
+          try:
+            cached = pcache.get(self.uid, pid, rmfile) if pcache else None
+          except Exception:
+            page = self._makePage([], 5, i)
+          else:
+            if cached is None:
+              pending.append((i, key, (pid, rmfile)))
+              yield rmfile
+              continue
+            page = self._finishPage(i, pid, *cached)
+        pending.append((i, key, page))
+        yield None
+
+    for r in pool.decode(paths()):
+      i, key, page = pending.popleft()
+      if r is not None:
+        pid, rmfile = page
+        if isinstance(r, Exception):
+          if not isinstance(r, FileNotFoundError): # i.e. an unannotated page
+            log.warning("Could not read page %s of %s [%s]", pid, self.uid, r)
+          page = self._makePage([], 5, i)
+        else:
+          if pcache:
+            pcache.put(self.uid, pid, rmfile, *r)
+          page = self._finishPage(i, pid, *r)
+      if cache is not None and key is not None:
+        cache.put(key, page)
+      yield page
+
+  # v6 pages record the names of their layers in the page itself
+  def _layer(self, l, name, highlights):
+    if isinstance(l, Layer):
+      return Layer(l.strokes, l.name or name, highlights)
+    return Layer(l, name, highlights)
+
+  # Name and highlights of each of the `n` layers of page `pid`
+  def _layerInfo(self, pid, n):
+    try:
+      mfile = self.fsource.retrieve(self.uid, pid + '-metadata', ext='json')
+      with open(mfile, 'r') as f:
+        layerNames = json.load(f)
+      layerNames = layerNames["layers"]
+    except Exception:
+      layerNames = [{"name": "Layer %d" % j} for j in range(n)]
+
+    highlights = {}
+    try:
+      if self.fsource.exists(self.uid + '.highlights', pid, ext='json'):
+        hfile = self.fsource.retrieve(self.uid + '.highlights', pid, ext='json')
+        with open(hfile, 'r') as f:
+          h = json.load(f).get('highlights', [])
+        for i in range(len(h)):
+          highlights[i] = h[i]
+    except Exception:
+      pass # empty highlights are ok
+
+    return [(layerNames[j].get("name"), highlights.get(j, [])) for j in range(n)]
+
+  # Progressive variant of getPage: returns the page right away,
+  # together with a generator of (layer index, stroke) pairs;
+  # the strokes of the layers of the page are filled in while the
+  # generator is consumed, and the complete page is then cached.
+  def streamPage(self, pageNum):
+    try:
+      pid = self.getPageId(pageNum)
+      rmfile = self.fsource.retrieve(self.uid, pid, ext='rm')
+    except:
+      return (self._makePage([], 5, pageNum), iter(()))
+    cache = self.index.pageCache
+    key = self._pageKey(pageNum, pid, rmfile)
+    page = cache.get(key) if cache is not None else None
+    if page is None:
+      try:
+        pcache = self.fsource.pageCache
+        cached = pcache.get(self.uid, pid, rmfile) if pcache else None
+        if cached is None:
+          f = open(rmfile, 'rb')
+          try:
+            (ver, names, strokes) = streamLines(f)
+          except:
+            f.close()
+            raise
+      except:
+        return (self._makePage([], 5, pageNum), iter(()))
+      if cached is None:
+        layerInfo = self._layerInfo(pid, len(names))
+        layers = [Layer([], name or n, h) for name, (n, h) in zip(names, layerInfo)]
+        page = self._makePage(layers, ver, pageNum)
+        return (page, self._fillPage(page, key, pid, rmfile, f, names, strokes))
+      page = self._finishPage(pageNum, pid, *cached)
+      if cache is not None:
+        cache.put(key, page)
+    return (page, ((j, k) for j, l in enumerate(page.layers) for k in l.strokes))
+
+  def _fillPage(self, page, key, pid, rmfile, f, names, strokes):
+    with f:
+      try:
+        for (j, k) in strokes:
+          page.layers[j].strokes.append(k)
+          yield (j, k)
+      except InvalidFormat as e:
+        log.warning("Could not read page %s of %s [%s]", pid, self.uid, e)
+        return # a partial page is not cached
+    if self.index.pageCache is not None:
+      self.index.pageCache.put(key, page)
+    if self.fsource.pageCache:
+      layers = [l.strokes if name is None else Layer(l.strokes, name, [])
+                for l, name in zip(page.layers, names)]
+      self.fsource.pageCache.put(self.uid, pid, rmfile, page.version, layers)
+
+  def _readPage(self, pid, rmfile):
+    cache = self.fsource.pageCache
+    if cache:
+      page = cache.get(self.uid, pid, rmfile)
+      if page:
+        return page
+    with open(rmfile, 'rb') as f:
+      (ver, layers) = readLines(f)
+    if cache:
+      cache.put(self.uid, pid, rmfile, ver, layers)
+    return (ver, layers)
+
   def _fallbackPageCount(self):
     return 0
 
@@ -362,6 +533,22 @@ class Document(Entry):
           highlights.append(h)
     return highlights
 
+  # What page `pageNum` is rendered from, to tell whether it changed
+  # since it was last exported: its id and the modification time and size
+  # of its lines, layers and highlights files (None if missing).
+  def pageSignature(self, pageNum):
+    pid = self.getPageId(pageNum)
+    sig = [pid]
+    for f in [(self.uid, pid + '.rm'),
+              (self.uid, pid + '-metadata.json'),
+              (self.uid + '.highlights', pid + '.json')]:
+      try:
+        st = stat(self.fsource.retrieve(*f))
+        sig.append([st.st_mtime_ns, st.st_size])
+      except Exception:
+        sig.append(None)
+    return sig
+
   def marked(self, pageNum, highlights=True):
     pid = self.getPageId(pageNum)
     if self.fsource.exists(self.uid, pid, ext='rm'):
@@ -400,6 +587,14 @@ class Document(Entry):
 Page = namedtuple('Page', ['layers', 'version', 'pageNum', 'document', 'background'],
                                     defaults = [ None,      None,       None ])
 
+# Rough estimate of the memory taken by a decoded page
+def pageSize(page):
+  return 1024 + sum(
+    128 + len(k.segments) * S_SEGMENT.size
+    for l in page.layers
+    for k in l.strokes
+  )
+
 Template = namedtuple('Template', ['name', 'retrieve'])
 
 # Here 'background' is either None or a Template object.
@@ -422,7 +617,7 @@ class Notebook(Document):
       t = self._bg[pageNum]
       if t:
         def retrieve(preferVector=False):
-          return self.fsource.retrieveTemplate(t)
+          return self.fsource.retrieveTemplate(t, preferVector=preferVector)
         template = Template(t, retrieve)
       else:
         template = None
@@ -430,6 +625,14 @@ class Notebook(Document):
       template = None
     return Page(layers, version, pageNum, document=self, background=template)
 
+  def pageSignature(self, pageNum):
+    sig = Document.pageSignature(self, pageNum)
+    try:
+      sig.append(self._bg[pageNum])
+    except Exception:
+      sig.append(None)
+    return sig
+
   def typeName(self):
     return "notebook"
 
@@ -570,8 +773,10 @@ class RemarkableIndex:
 
   _upd_lock = RLock()
 
-  def __init__(self, fsource, progress=(lambda x,tot: None)):
+  def __init__(self, fsource, progress=(lambda x,tot: None), cache_size=128 * 2**20):
     self.fsource = fsource
+    # decoded pages, shared by previews, thumbnails and exports
+    self.pageCache = LRUCache(cache_size, sizeof=pageSize)
     uids = list(fsource.listItems())
     index = {ROOT_ID: RootFolder(self)}
     tags = {}
@@ -0,0 +1,124 @@
+import os
+import os.path as path
+import time
+from threading import RLock, get_ident
+
+from remy.remarkable.lines import packLines, unpackLines, InvalidFormat
+
+from remy.utils import log
+
+
+class PageCache():
+  """
+  Decoded pages stored on disk in the compact format of `packLines`.
+  Entries are keyed by document uid, page id and the modification time
+  and size of the `.rm` file they were decoded from, so a modified page
+  is never served stale.
+  When the cache grows over `max_bytes` the least recently used entries
+  are removed.
+  """
+
+  EXT = '.page'
+
+  def __init__(self, root, max_bytes=256 * 2**20):
+    self.root = root
+    self.max_bytes = max_bytes
+    self._lock = RLock()
+    self._entries = None # path -> [size, last use]
+    self._total = 0
+
+  def _path(self, uid, pid, rmfile):
+    st = os.stat(rmfile)
+    return path.join(self.root, uid, "%s-%d-%d%s" % (pid, st.st_mtime_ns, st.st_size, self.EXT))
+
+  def _scan(self):
+    # Called with the lock held
+    if self._entries is None:
+      self._entries = {}
+      self._total = 0
+      if path.isdir(self.root):
+        for d in os.scandir(self.root):
+          if d.is_dir():
+            for e in os.scandir(d.path):
+              if e.name.endswith(self.EXT):
+                st = e.stat()
+                self._entries[e.path] = [st.st_size, st.st_mtime]
+                self._total += st.st_size
+
+  def _remove(self, p):
+    # Called with the lock held
+    try:
+      os.remove(p)
+    except OSError:
+      pass
+    e = self._entries.pop(p, None)
+    if e:
+      self._total -= e[0]
+
+  def get(self, uid, pid, rmfile):
+    try:
+      p = self._path(uid, pid, rmfile)
+      with open(p, 'rb') as f:
+        data = f.read()
+    except OSError:
+      return None
+    with self._lock:
+      self._scan()
+      try:
+        page = unpackLines(data)
+      except InvalidFormat:
+        log.debug("Removing corrupted cache entry %s", p)
+        self._remove(p)
+        return None
+      now = time.time()
+      try:
+        os.utime(p, (now, now)) # so that usage survives restarts
+      except OSError:
+        pass
+      if p in self._entries:
+        self._entries[p][1] = now
+      else:
+        self._entries[p] = [len(data), now]
+        self._total += len(data)
+    return page
+
+  def put(self, uid, pid, rmfile, ver, layers):
+    try:
+      p = self._path(uid, pid, rmfile)
+      data = packLines(ver, layers)
+      if len(data) > self.max_bytes:
+        return
+      d = path.dirname(p)
+      os.makedirs(d, exist_ok=True)
+      tmp = "%s.%d.tmp" % (p, get_ident())
+      with open(tmp, 'wb') as f:
+        f.write(data)
+      os.replace(tmp, p)
+    except OSError as e:
+      log.warning("Could not cache page %s of %s [%s]", pid, uid, e)
+      return
+    with self._lock:
+      self._scan()
+      # older versions of the same page are of no use anymore
+      prefix = path.join(d, pid + '-')
+      for q in [q for q in self._entries if q.startswith(prefix) and q != p]:
+        self._remove(q)
+      old = self._entries.get(p)
+      if old:
+        self._total -= old[0]
+      self._entries[p] = [len(data), time.time()]
+      self._total += len(data)
+      self._evict()
+
+  def _evict(self):
+    # Called with the lock held
+    if self._total > self.max_bytes:
+      for p, _ in sorted(self._entries.items(), key=lambda e: e[1][1]):
+        self._remove(p)
+        if self._total <= self.max_bytes:
+          break
+
+  def size(self):
+    with self._lock:
+      self._scan()
+      return self._total
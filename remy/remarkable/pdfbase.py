@@ -111,10 +111,12 @@ if RENDERER == MUPDF:
           if w > h:
             m.prerotate(270)
           pix = page.get_pixmap(alpha=False, matrix=m)
+          # copy: the image would otherwise point to the samples of pix,
+          # which do not outlive this call
           return QImage(pix.samples,
                         pix.width, pix.height,
                         pix.stride, # length of one image line in bytes
-                        QImage.Format_RGB888)
+                        QImage.Format_RGB888).copy()
       return QImage()
 
     def pageCount(self):
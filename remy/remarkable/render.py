@@ -9,9 +9,16 @@ import remy.remarkable.constants as rm
 from remy.remarkable.palette import *
 
 from itertools import groupby
+from threading import Lock
+import os
 
-import time
-from remy.utils import log
+from remy.utils import log, LRUCache
+
+# without QtSvg, templates are only available as images
+try:
+  from PyQt5.QtSvg import QSvgRenderer
+except ImportError:
+  QSvgRenderer = None
 
 
 QUICK_ERASER    = 0
@@ -29,6 +36,14 @@ ERASER_MODE = {
 }
 
 
+# numpy is optional: when available, simplification and smoothing
+# work on arrays of coordinates and many strokes at a time
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+
 # SIMPLIFICATION LIBRARY
 
 try:
@@ -36,12 +51,22 @@ try:
   from simplification.cutil import simplify_coords
 
   def simpl(stroke, tolerance=10.0):
+    if np is not None:
+      return simplify_coords(strokeCoords(stroke), tolerance)
     return simplify_coords([[s.x, s.y] for s in stroke.segments], tolerance)
 
 except Exception:
   simpl = None
 
 
+def strokeCoords(stroke):
+  # (n, 2) array of the coordinates of the segments of stroke
+  segs = stroke.segments
+  if hasattr(segs, 'column'):
+    return np.column_stack((segs.column('x'), segs.column('y'))).astype(float)
+  return np.array([(s.x, s.y) for s in segs], dtype=float).reshape(-1, 2)
+
+
 def dynamic_width(segment):
   return (segment.width,None)
 
@@ -63,9 +88,103 @@ def flat_pencil_width(segment):
 def flat_mech_pencil_width(segment):
   return (round(segment.width/1.5,2),round(segment.pressure, 2))
 
+# With batch_paths widths are rounded to multiples of WIDTH_QUANTUM,
+# so that more segments share the same pen
+WIDTH_QUANTUM = .25
+
+def quantized(calcwidth):
+  def quantized_width(segment):
+    w, p = calcwidth(segment)
+    return (round(w / WIDTH_QUANTUM) * WIDTH_QUANTUM, p)
+  quantized_width.unquantized = calcwidth
+  return quantized_width
+
 def const_width(w):
     return lambda segment: (w,None)
 
+# The same width functions, computed in bulk over the arrays of the widths
+# and pressures of the segments of a stroke (see segmentRuns)
+BULK_WIDTHS = {
+  dynamic_width:
+    lambda w, p: (w, None),
+  semi_dynamic_width:
+    lambda w, p: (np.round(w), None),
+  very_dynamic_width:
+    lambda w, p: (np.round(w * .7 + w * .3 * p, 2), None),
+  pencil_width:
+    lambda w, p: (np.round(w * .55, 2), pencilBrushes().getIndices(p)),
+  mech_pencil_width:
+    lambda w, p: (np.round(w / 1.5, 2), pencilBrushes().getIndices(p)),
+  flat_pencil_width:
+    lambda w, p: (np.round(w * .55, 2), np.round(p, 2)),
+  flat_mech_pencil_width:
+    lambda w, p: (np.round(w / 1.5, 2), np.round(p, 2)),
+}
+
+def polyline(coords):
+  # path through the points of the (n, 2) array coords, copied straight
+  # into the memory of a QPolygonF instead of adding them one by one
+  poly = QPolygonF(len(coords))
+  buf = poly.data()
+  buf.setsize(16 * len(coords))
+  np.frombuffer(buf, dtype=np.float64).reshape(-1, 2)[:] = coords
+  path = QPainterPath()
+  path.addPolygon(poly)
+  return path
+
+def segmentRuns(stroke, calcwidth):
+  """
+  Splits `stroke` where the width or texture given by calcwidth changes,
+  yielding ((width, texture), path) for each part in order, as grouping
+  the segments after the first with groupby(segments[1:], calcwidth) would.
+  With numpy the widths of all the segments are computed at once, and the
+  runs are found in a single pass over them.
+  """
+  segs = stroke.segments
+  if len(segs) < 2:
+    return
+  bulk = BULK_WIDTHS.get(getattr(calcwidth, 'unquantized', calcwidth))
+  if np is None or bulk is None or not hasattr(segs, 'column'):
+    path = QPainterPath(QPointF(segs[0].x, segs[0].y))
+    for wp, segments in groupby(segs[1:], calcwidth):
+      for s in segments:
+        path.lineTo(s.x, s.y)
+      yield (wp, path)
+      path = QPainterPath(path.currentPosition())
+    return
+  w, p = bulk(segs.column('width')[1:].astype(float), segs.column('pressure')[1:].astype(float))
+  if hasattr(calcwidth, 'unquantized'):
+    w = np.round(w / WIDTH_QUANTUM) * WIDTH_QUANTUM
+  change = w[1:] != w[:-1]
+  if p is not None:
+    change |= p[1:] != p[:-1]
+  # the part ending with segment i has the width of w[i - 1]
+  ends = np.append(np.flatnonzero(change) + 2, len(segs))
+  ws = w[ends - 2].tolist()
+  ps = p[ends - 2].tolist() if p is not None else [None] * len(ends)
+  coords = strokeCoords(stroke)
+  points = coords.tolist()
+  start = 0
+  for end, wi, pi in zip(ends.tolist(), ws, ps):
+    if end - start > 16:
+      path = polyline(coords[start:end])
+    else:
+      # quicker for the short parts of strokes whose pressure varies a lot
+      path = QPainterPath(QPointF(*points[start]))
+      for x, y in points[start + 1:end]:
+        path.lineTo(x, y)
+    yield ((wi, pi), path)
+    start = end - 1
+
+# In AUTO_ERASER mode, erasers following one of these strokes
+# in the same layer are rendered accurately
+def needsAccurateEraser(tool, stroke):
+  if tool == rm.BRUSH_TOOL or tool == rm.MARKER_TOOL:
+    return True
+  if tool == rm.PENCIL_TOOL:
+    return max(s.width for s in stroke.segments) > 2
+  return False
+
 def _progress(p, i, t):
   if callable(p):
     p(i, t)
@@ -88,6 +207,60 @@ class QGraphicsPathItemD(QGraphicsPathItem):
 
 
 
+class PathBatcher():
+  """
+  Merges the paths of consecutive strokes into few items.
+  Within a run of paths painted with the same opaque colour the painting
+  order makes no difference, so the run is collected into one path per
+  pen (width and brush) and each becomes a single item when the run ends.
+  Translucent paths are not merged.
+  Paths are emitted early when they reach `maxElements`, as very large
+  paths are slower to stroke than many small ones.
+  """
+
+  maxElements = 500
+
+  def __init__(self):
+    self._run = None
+    self._parent = None
+    self._paths = {} # pen state -> [pen, path]
+
+  # `state` identifies the pen among the ones of the same colour
+  def add(self, path, pen, parent, state, PathItem=QGraphicsPathItem, z=0):
+    color = pen.color()
+    run = (id(parent), PathItem, z, color.rgba())
+    if run != self._run:
+      self.flush()
+      if color.alpha() < 255:
+        self._item(PathItem, path, pen, parent, z)
+        return
+      self._run = run
+      self._parent = parent
+    if state in self._paths:
+      batch = self._paths[state]
+      batch[1].addPath(path)
+      if batch[1].elementCount() >= self.maxElements:
+        self._item(PathItem, batch[1], batch[0], parent, z)
+        del self._paths[state]
+    else:
+      self._paths[state] = [QPen(pen), QPainterPath(path)]
+
+  def flush(self):
+    if self._run is not None:
+      _, PathItem, z, _ = self._run
+      for pen, path in self._paths.values():
+        self._item(PathItem, path, pen, self._parent, z)
+      self._paths = {}
+      self._run = None
+      self._parent = None
+
+  def _item(self, PathItem, path, pen, parent, z):
+    item = PathItem(path, parent)
+    item.setPen(pen)
+    if z:
+      item.setZValue(z)
+
+
 class PencilBrushes():
 
   def __init__(self, N=15, size=200, color=Qt.black):
@@ -104,6 +277,11 @@ class PencilBrushes():
     i = int(i * (len(self._textures)-1))
     return max(0, min(i, len(self._textures)-1))
 
+  def getIndices(self, a):
+    # getIndex of each value of the array a
+    n = len(self._textures) - 1
+    return np.clip((a * n).astype(int), 0, n)
+
   def getTexture(self, i):
     return self._textures[max(0,min(i, len(self._textures)-1))]
 
@@ -167,253 +345,466 @@ def bezierInterpolation(K, coord):
   return (p1,p2)
 
 
+def bezierControlPoints(coords, batch=256):
+  """
+  Same as bezierInterpolation, for both coordinates of a list of (n, 2)
+  arrays of points (with n > 2), returning a pair of (n-1, 2) arrays of
+  control points for each.
+  The tridiagonal systems of up to `batch` strokes of similar lengths
+  are solved at once, padded with identity rows to the longest of them.
+  """
+  order = sorted(range(len(coords)), key=lambda i: len(coords[i]))
+  result = [None] * len(coords)
+  for start in range(0, len(order), batch):
+    group = order[start:start + batch]
+    ns = np.array([len(coords[i]) - 1 for i in group])
+    S, N = len(group), ns.max()
+    rows = np.arange(S)
+    last = ns - 1
+    # rows are indexed first, so that each step of the sweeps is contiguous
+    K = np.zeros((N + 1, S, 2))
+    for s, i in enumerate(group):
+      K[:ns[s] + 1, s] = coords[i]
+    r = 4. * K[:N] + 2. * K[1:]
+    r[0] = K[0] + 2. * K[1]
+    r[last, rows] = 8. * K[last, rows] + K[last + 1, rows]
+    # The elimination factors m and the diagonal b of the Thomas algorithm
+    # do not depend on the points: up to the last row of each system they
+    # follow the same sequence, computed once
+    bs = [2.]
+    for i in range(1, N):
+      bs.append(4. - 1. / bs[-1])
+    bs = np.array(bs)
+    idx = np.arange(N)[:, None]
+    m = np.where(idx <= last, 1. / np.roll(bs, 1)[:, None], 0.)
+    m[0] = 0.
+    m[last, rows] = 2. / bs[last - 1]
+    b = np.where(idx < last, bs[:, None], 1.)
+    b[last, rows] = 7. - m[last, rows]
+    c = (idx < last).astype(float)
+    r[idx > last] = 0.
+    for i in range(1, N):
+      r[i] -= m[i, :, None] * r[i - 1]
+    r /= b[:, :, None]
+    c /= b
+    p1 = r
+    for i in range(N - 2, -1, -1):
+      p1[i] -= c[i, :, None] * p1[i + 1]
+    p2 = np.empty_like(p1)
+    p2[:N - 1] = 2. * K[1:N] - p1[1:N]
+    p2[last, rows] = .5 * (K[last + 1, rows] + p1[last, rows])
+    for s, i in enumerate(group):
+      result[i] = (p1[:ns[s], s], p2[:ns[s], s])
+  return result
+
+
+def strokeCurves(strokes, simplify=0, smoothen=False):
+  """
+  The points of each stroke, simplified with tolerance `simplify` if
+  positive, and the control points of the Bezier curves through them
+  if `smoothen`, as (points, c1, c2) lists (c1 and c2 are None when the
+  points are to be joined by lines).
+  """
+  if np is None:
+    curves = []
+    for k in strokes:
+      sk = simpl(k, simplify) if simplify > 0 else k.segments
+      if smoothen and len(sk) > 2:
+        px1, px2 = bezierInterpolation(sk, 0)
+        py1, py2 = bezierInterpolation(sk, 1)
+        curves.append(([(p[0], p[1]) for p in sk], list(zip(px1, py1)), list(zip(px2, py2))))
+      else:
+        curves.append(([(p[0], p[1]) for p in sk], None, None))
+    return curves
+  if simplify > 0:
+    coords = [simpl(k, simplify) for k in strokes]
+  else:
+    coords = [strokeCoords(k) for k in strokes]
+  curves = [(c.tolist(), None, None) for c in coords]
+  if smoothen:
+    smooth = [i for i, c in enumerate(coords) if len(c) > 2]
+    cps = bezierControlPoints([coords[i] for i in smooth])
+    for i, (c1, c2) in zip(smooth, cps):
+      curves[i] = (curves[i][0], c1.tolist(), c2.tolist())
+  return curves
+
+
+
+# The area covered by accurate erasers is computed as a QRegion
+# with ERASER_RESOLUTION units per pixel: unions of regions are cheap and,
+# being made of disjoint rectangles, they give a clip path with the OddEven
+# rule without resorting to QPainterPath.simplified(), which is expensive.
+ERASER_RESOLUTION = 4
+
+def eraserRegion(stroke, stroker):
+  stroker.setWidth(stroke.width)
+  path = QPainterPath(QPointF(stroke.segments[0].x, stroke.segments[0].y))
+  for s in stroke.segments[1:]:
+    path.lineTo(s.x,s.y)
+  path = stroker.createStroke(path)
+  poly = path.toFillPolygon(QTransform.fromScale(ERASER_RESOLUTION, ERASER_RESOLUTION))
+  return QRegion(poly.toPolygon(), Qt.WindingFill)
+
+# The page minus the erased region
+def erasedClip(region):
+  area = QPainterPath()
+  area.addRect(0,0,rm.WIDTH,rm.HEIGHT)
+  hole = QPainterPath()
+  hole.addRegion(region)
+  area.addPath(hole * QTransform.fromScale(1/ERASER_RESOLUTION, 1/ERASER_RESOLUTION))
+  return area
+
+# Drawing operations produced by pageOps
+OP_LAYER     = 0  # (OP_LAYER,)  a new layer starts
+OP_HIGHLIGHT = 1  # (OP_HIGHLIGHT, rect, color, text)  a highlighted text area
+OP_PATH      = 2  # (OP_PATH, path, pen, state, darken, z)  a stroked path
+OP_ERASE     = 3  # (OP_ERASE, area)  clip everything drawn so far in the layer to area
+OP_LAYER_END = 4  # (OP_LAYER_END,)
+
+def pageOps(
+    page,
+    palette={},
+    # colors=None,
+    # highlight=DEFAULT_HIGHLIGHT,
+    pencil_resolution=.4,
+    thickness_scale=1,
+    # thickness_scale_artistic=False,
+    simplify=0,
+    smoothen=False,
+    eraser_mode=AUTO_ERASER,
+    progress=None,
+    draw_hl_below=True,
+    exclude_layers=set(),
+    exclude_tools=set(),
+    batch_paths=False
+):
+  # Yields the operations to draw `page`, in painting order
+  # except for paths with negative z, which go below the others of their layer.
+  # The pen is reused: consumers must copy it if they keep it.
+  # `state` identifies the pen among the ones of the same colour (see PathBatcher).
+
+  if isinstance(eraser_mode, str):
+    eraser_mode = ERASER_MODE.get(eraser_mode, AUTO_ERASER)
+  if not isinstance(palette, Palette):
+    palette = Palette(palette)
+
+  # if isinstance(colors, dict):
+  #   if 'highlight' in colors:
+  #     highlight = colors['highlight']
+  #     if not isinstance(highlight, dict):
+  #       highlight = {1: highlight, 3: highlight, 4: highlight, 5: highlight}
+  #   colors = {
+  #     0: QColor(colors.get('black', DEFAULT_COLORS[0])),
+  #     1: QColor(colors.get('gray', DEFAULT_COLORS[1])),
+  #     2: QColor(colors.get('white', DEFAULT_COLORS[2])),
+  #     6: QColor(colors.get('blue', DEFAULT_COLORS[6])),
+  #     7: QColor(colors.get('red', DEFAULT_COLORS[7])),
+  #   }
+  # else:
+  #   colors = DEFAULT_COLORS
+
+  if simpl is None:
+    simplify = 0
+    log.warning("Simplification parameters ignored since the simplification library is not installed")
+
+  eraserStroker = QPainterPathStroker()
+  eraserStroker.setCapStyle(Qt.RoundCap)
+  eraserStroker.setJoinStyle(Qt.RoundJoin)
+
+  pen = QPen()
+  pen.setWidth(1)
+  pen.setCapStyle(Qt.RoundCap)
+  pen.setJoinStyle(Qt.RoundJoin)
+
+  totalStrokes = sum(len(l.strokes) for l in page.layers)
+  curStroke = 0
+  _progress(progress,curStroke,totalStrokes); curStroke += 1
+
+  for li, l in enumerate(page.layers):
+    if li+1 in exclude_layers or l.name in exclude_layers:
+      continue
+    yield (OP_LAYER,)
+    erased = None
+    if (l.highlights
+        and l.name + "/highlights" not in exclude_layers
+        and str(li+1) + "/highlights" not in exclude_layers):
+      # then
+      for hi in l.highlights:
+        hcolor = hi.get('color', 1)
+        for r in hi.get('rects', []):
+          rect = QRectF(r.get('x',0),r.get('y',0),r.get('width',0), r.get('height',0))
+          yield (OP_HIGHLIGHT, rect, palette.highlight(hcolor), hi.get('text',''))
+    if eraser_mode >= AUTO_ERASER:
+      eraser_mode = AUTO_ERASER_IGNORE
+    if simplify > 0 or smoothen:
+      # the curves of the whole layer are computed at once
+      curves = iter(strokeCurves(
+        [k for k in l.strokes
+         if rm.TOOL_ID.get(k.pen) in (rm.FINELINER_TOOL, rm.BALLPOINT_TOOL)
+         and rm.TOOL_ID.get(k.pen) not in exclude_tools],
+        simplify, smoothen))
+
+    for k in l.strokes:
+      tool = rm.TOOL_ID.get(k.pen)
+      if tool in exclude_tools:
+        # log.info("Ignoring %s", rm.TOOL_NAME.get(tool))
+        continue
 
-class PageGraphicsItem(QGraphicsRectItem):
+      # COLOR
+      if tool == rm.ERASER_TOOL:
+        pen.setColor(Qt.white)
+      else:
+        color = palette.colorFor(tool, k.color)
+        if color is None:
+          log.error("Tool %s Color %s not defined", rm.TOOL_NAME.get(tool, tool), k.color)
+          pen.setColor(Qt.red)
+        else:
+          pen.setColor(color)
 
-  def __init__(
-      self,
-      page,
-      palette={},
-      # colors=None,
-      # highlight=DEFAULT_HIGHLIGHT,
-      pencil_resolution=.4,
-      thickness_scale=1,
-      # thickness_scale_artistic=False,
-      simplify=0,
-      smoothen=False,
-      eraser_mode=AUTO_ERASER,
-      parent=None,
-      progress=None,
-      draw_hl_below=True,
-      exclude_layers=set(),
-      exclude_tools=set()
-  ):
-    super().__init__(0,0,rm.WIDTH,rm.HEIGHT,parent)
+      # WIDTH CALCULATION
+      if tool == rm.PENCIL_TOOL:
+        if pencil_resolution > 0:
+          calcwidth = pencil_width
+        else:
+          calcwidth = flat_pencil_width
+      elif tool == rm.MECH_PENCIL_TOOL:
+        if pencil_resolution > 0:
+          calcwidth = mech_pencil_width
+        else:
+          calcwidth = flat_mech_pencil_width
+      elif tool == rm.BALLPOINT_TOOL:
+        calcwidth = semi_dynamic_width
+        # calcwidth = const_width(k.width)
+      else:
+        calcwidth = dynamic_width
+      if batch_paths:
+        calcwidth = quantized(calcwidth)
+
+      # AUTO ERASER SETTINGS
+      if eraser_mode == AUTO_ERASER and needsAccurateEraser(tool, k):
+        eraser_mode = AUTO_ERASER_ACCURATE
+
+      pen.setWidthF(0)
+      path = None
+
+      if k.pen == 8:
+        # ERASE AREA
+        # The remarkable renderer seems to ignore these!
+        pass
+      elif k.pen == 6 and eraser_mode % 3 == IGNORE_ERASER:
+        pass
+      elif k.pen == 6 and eraser_mode % 3 == ACCURATE_ERASER:
+        # ERASER
+        # the clip is emitted before the next stroke that draws,
+        # so that consecutive erasers share it
+        r = eraserRegion(k, eraserStroker)
+        erased = r if erased is None else erased.united(r)
+      else:
+        if erased is not None:
+          yield (OP_ERASE, erasedClip(erased))
+          erased = None
+        if (simplify > 0 or smoothen) and (tool == rm.FINELINER_TOOL or tool == rm.BALLPOINT_TOOL):
+          pen.setWidthF(thickness_scale*k.width)
+          points, c1, c2 = next(curves)
+          path = QPainterPath(QPointF(*points[0]))
+          if c1 is not None:
+            for (x1, y1), (x2, y2), (x, y) in zip(c1, c2, points[1:]):
+              path.cubicTo(x1, y1, x2, y2, x, y)
+          else:
+            for (x, y) in points[1:]:
+              path.lineTo(x, y)
+          yield (OP_PATH, path, pen, (pen.widthF(), None), False, 0)
+        else:
+          # STANDARD
+          for (w,p), path in segmentRuns(k, calcwidth):
+            path.setFillRule(Qt.WindingFill)
+            if pencil_resolution > 0 and tool == rm.PENCIL_TOOL and p:
+              # draw fuzzy edges
+              pen.setBrush(pencilBrushes().getBrush(int(p*.7), scale=pencil_resolution))
+              pen.setWidthF(thickness_scale*w*1.15)
+              yield (OP_PATH, path, pen, (pen.widthF(), int(p*.7)), False, 0)
+
+            pen.setWidthF(thickness_scale*w)
+            if p is not None:
+              if pencil_resolution > 0:
+                pen.setBrush(pencilBrushes().getBrush(p, scale=pencil_resolution))
+              elif pencil_resolution == 0:
+                pen.setColor(QColor(int(p*255),int(p*255),int(p*255)))
+              else:
+                pen.setColor(palette.get('black'))
+            darken = tool == rm.HIGHLIGHTER_TOOL # and k.color != 1:
+            z = -1 if draw_hl_below and tool == rm.HIGHLIGHTER_TOOL else 0
+            texture = p if p is not None and pencil_resolution > 0 else None
+            yield (OP_PATH, path, pen, (pen.widthF(), texture), darken, z)
+          # END STANDARD
 
-    if isinstance(eraser_mode, str):
-      eraser_mode = ERASER_MODE.get(eraser_mode, AUTO_ERASER)
-    if not isinstance(palette, Palette):
-      palette = Palette(palette)
-
-    # if isinstance(colors, dict):
-    #   if 'highlight' in colors:
-    #     highlight = colors['highlight']
-    #     if not isinstance(highlight, dict):
-    #       highlight = {1: highlight, 3: highlight, 4: highlight, 5: highlight}
-    #   colors = {
-    #     0: QColor(colors.get('black', DEFAULT_COLORS[0])),
-    #     1: QColor(colors.get('gray', DEFAULT_COLORS[1])),
-    #     2: QColor(colors.get('white', DEFAULT_COLORS[2])),
-    #     6: QColor(colors.get('blue', DEFAULT_COLORS[6])),
-    #     7: QColor(colors.get('red', DEFAULT_COLORS[7])),
-    #   }
-    # else:
-    #   colors = DEFAULT_COLORS
-
-    if simpl is None:
-      simplify = 0
-      log.warning("Simplification parameters ignored since the simplification library is not installed")
+      _progress(progress,curStroke,totalStrokes); curStroke += 1
 
-    noPen = QPen(Qt.NoPen)
-    noPen.setWidth(0)
-    self.setPen(noPen)
-    eraserStroker = QPainterPathStroker()
-    eraserStroker.setCapStyle(Qt.RoundCap)
-    eraserStroker.setJoinStyle(Qt.RoundJoin)
+    if erased is not None:
+      yield (OP_ERASE, erasedClip(erased))
+    yield (OP_LAYER_END,)
 
-    pen = QPen()
-    pen.setWidth(1)
-    pen.setCapStyle(Qt.RoundCap)
-    pen.setJoinStyle(Qt.RoundJoin)
 
-    totalStrokes = sum(len(l.strokes) for l in page.layers)
-    curStroke = 0
-    _progress(progress,curStroke,totalStrokes); curStroke += 1
 
-    for li, l in enumerate(page.layers):
-      if li+1 in exclude_layers or l.name in exclude_layers:
-        continue
-      if (l.highlights
-          and l.name + "/highlights" not in exclude_layers
-          and str(li+1) + "/highlights" not in exclude_layers):
-        # then
-        h = QGraphicsRectItem(self)
-        h.setPen(QPen(Qt.NoPen))
-        for hi in l.highlights:
-          hcolor = hi.get('color', 1)
-          for r in hi.get('rects', []):
-            ri = QGraphicsRectItemD(r.get('x',0),r.get('y',0),r.get('width',0), r.get('height',0), h)
-            ri.setPen(QPen(Qt.NoPen))
-            ri.setBrush(palette.highlight(hcolor))
-            ri.setToolTip(hi.get('text',''))
-      group = QGraphicsPathItem()
-      group.setPen(noPen)
-      if eraser_mode >= AUTO_ERASER:
-        eraser_mode = AUTO_ERASER_IGNORE
-
-      for k in l.strokes:
-        tool = rm.TOOL_ID.get(k.pen)
-        if tool in exclude_tools:
-          # log.info("Ignoring %s", rm.TOOL_NAME.get(tool))
-          continue
+class PageGraphicsItem(QGraphicsRectItem):
 
-        # COLOR
-        if tool == rm.ERASER_TOOL:
-          pen.setColor(Qt.white)
-        else:
-          color = palette.colorFor(tool, k.color)
-          if color is None:
-            log.error("Tool %s Color %s not defined", rm.TOOL_NAME.get(tool, tool), k.color)
-            pen.setColor(Qt.red)
-          else:
-            pen.setColor(color)
+  def __init__(self, page, parent=None, batch_paths=False, **kw):
+    # see pageOps for the options
+    super().__init__(0,0,rm.WIDTH,rm.HEIGHT,parent)
 
-        # WIDTH CALCULATION
-        if tool == rm.PENCIL_TOOL:
-          if pencil_resolution > 0:
-            calcwidth = pencil_width
-          else:
-            calcwidth = flat_pencil_width
-        elif tool == rm.MECH_PENCIL_TOOL:
-          if pencil_resolution > 0:
-            calcwidth = mech_pencil_width
-          else:
-            calcwidth = flat_mech_pencil_width
-        elif tool == rm.BALLPOINT_TOOL:
-          calcwidth = semi_dynamic_width
-          # calcwidth = const_width(k.width)
-        else:
-          calcwidth = dynamic_width
-
-        # AUTO ERASER SETTINGS
-        if tool == rm.BRUSH_TOOL or tool == rm.MARKER_TOOL:
-          if eraser_mode == AUTO_ERASER:
-            eraser_mode = AUTO_ERASER_ACCURATE
-        elif tool == rm.PENCIL_TOOL:
-          if eraser_mode == AUTO_ERASER:
-            if max(s.width for s in k.segments) > 2:
-              eraser_mode = AUTO_ERASER_ACCURATE
-
-        pen.setWidthF(0)
-        path = None
-
-        if k.pen == 8:
-          # ERASE AREA
-          # The remarkable renderer seems to ignore these!
-          pass
-        elif k.pen == 6 and eraser_mode % 3 == IGNORE_ERASER:
-          pass
-        elif k.pen == 6 and eraser_mode % 3 == ACCURATE_ERASER:
-          # ERASER
-          T1 = time.perf_counter()
-          eraserStroker.setWidth(k.width)
-          area = QPainterPath(QPointF(0,0))
-          area.moveTo(0,0)
-          area.lineTo(0,rm.HEIGHT)
-          area.lineTo(rm.WIDTH,rm.HEIGHT)
-          area.lineTo(rm.WIDTH,0)
-          area.lineTo(0,0)
-          subarea = QPainterPath(QPointF(k.segments[0].x, k.segments[0].y))
-          for s in k.segments[1:]:
-            subarea.lineTo(s.x,s.y)
-          subarea = eraserStroker.createStroke(subarea)
-          log.debug('A: %f', time.perf_counter() - T1); T1 = time.perf_counter()
-          subarea = subarea.simplified()  # this is expensive
-          log.debug('B: %f', time.perf_counter() - T1); T1 = time.perf_counter()
-          # area = fullPageClip.subtracted(subarea)  # this alternative is also expensive
-          area.addPath(subarea)
-          group.setFlag(QGraphicsItem.ItemClipsChildrenToShape)
-          group.setPath(area)
-          ### good for testing:
-          # group.setPen(Qt.red)
-          # group.setBrush(QBrush(QColor(255,0,0,50)))
-          newgroup = QGraphicsPathItem()
-          newgroup.setPen(noPen)
-          group.setParentItem(newgroup)
-          group = newgroup
+    noPen = QPen(Qt.NoPen)
+    noPen.setWidth(0)
+    self.setPen(noPen)
+
+    # with batch_paths, paths are merged by pen (see PathBatcher)
+    batcher = PathBatcher() if batch_paths else None
+
+    h = group = None
+    for op in pageOps(page, batch_paths=batch_paths, **kw):
+      kind = op[0]
+      if kind == OP_PATH:
+        _, path, pen, state, darken, z = op
+        PathItem = QGraphicsPathItemD if darken else QGraphicsPathItem
+        if batcher:
+          batcher.add(path, pen, group, state, PathItem, z)
         else:
-          if (simplify > 0 or smoothen) and (tool == rm.FINELINER_TOOL or tool == rm.BALLPOINT_TOOL):
-            pen.setWidthF(thickness_scale*k.width)
-            if simplify > 0:
-              sk = simpl(k, simplify)
-            else:
-              sk = k.segments
-            path = QPainterPath(QPointF(sk[0][0], sk[0][1]))
-            if len(sk) == 2:
-              path.lineTo(sk[1][0],sk[1][1])
-            elif smoothen:
-              px1, px2 = bezierInterpolation(sk, 0)
-              py1, py2 = bezierInterpolation(sk, 1)
-              for i in range(1,len(sk)):
-                path.cubicTo(px1[i-1],py1[i-1],px2[i-1],py2[i-1],sk[i][0],sk[i][1])
-            else:
-              for i in range(1,len(sk)):
-                path.lineTo(sk[i][0],sk[i][1])
-            item=QGraphicsPathItem(path, group)
-            item.setPen(pen)
-          else:
-            # STANDARD
-            path = QPainterPath(QPointF(k.segments[0].x, k.segments[0].y))
-            path.setFillRule(Qt.WindingFill)
-            for (w,p), segments in groupby(k.segments[1:], calcwidth):
-              for s in segments:
-                path.lineTo(s.x,s.y)
-
-              if pencil_resolution > 0 and tool == rm.PENCIL_TOOL and p:
-                # draw fuzzy edges
-                item=QGraphicsPathItem(path, group)
-                pen.setBrush(pencilBrushes().getBrush(int(p*.7), scale=pencil_resolution))
-                pen.setWidthF(thickness_scale*w*1.15)
-                item.setPen(pen)
-
-              pen.setWidthF(thickness_scale*w)
-              if p is not None:
-                if pencil_resolution > 0:
-                  pen.setBrush(pencilBrushes().getBrush(p, scale=pencil_resolution))
-                elif pencil_resolution == 0:
-                  pen.setColor(QColor(int(p*255),int(p*255),int(p*255)))
-                else:
-                  pen.setColor(palette.get('black'))
-              if tool == rm.HIGHLIGHTER_TOOL: # and k.color != 1:
-                PathItem = QGraphicsPathItemD
-              else:
-                PathItem = QGraphicsPathItem
-              item=PathItem(path, group)
-              item.setPen(pen)
-              if draw_hl_below and tool == rm.HIGHLIGHTER_TOOL:
-                item.setZValue(-1)
-              path = QPainterPath(path.currentPosition())
-              path.setFillRule(Qt.WindingFill)
-            # END STANDARD
-
-        _progress(progress,curStroke,totalStrokes); curStroke += 1
-
-      group.setParentItem(self)
-
-
-_TEMPLATE_CACHE = {}
-
-# TODO:
-#   from PyQt5.QtSvg import QSvgRenderer
-#   cache r=QSvgRenderer(svgfile)
-#   and use i=QGraphicsSvgItem(); i.setSharedRenderer(r)
-def pixmapOfBackground(bg):
-  if bg and bg.name not in _TEMPLATE_CACHE:
-    bgf = bg.retrieve()
-    if bgf:
-      _TEMPLATE_CACHE[bg.name] = QPixmap.fromImage(QImage(bgf))
+          item = PathItem(path, group)
+          item.setPen(pen)
+          if z:
+            item.setZValue(z)
+      elif kind == OP_HIGHLIGHT:
+        _, rect, color, text = op
+        if h is None:
+          h = QGraphicsRectItem(self)
+          h.setPen(QPen(Qt.NoPen))
+        ri = QGraphicsRectItemD(rect, h)
+        ri.setPen(QPen(Qt.NoPen))
+        ri.setBrush(color)
+        ri.setToolTip(text)
+      elif kind == OP_ERASE:
+        if batcher:
+          batcher.flush()
+        group.setFlag(QGraphicsItem.ItemClipsChildrenToShape)
+        group.setPath(op[1])
+        ### good for testing:
+        # group.setPen(Qt.red)
+        # group.setBrush(QBrush(QColor(255,0,0,50)))
+        newgroup = QGraphicsPathItem()
+        newgroup.setPen(noPen)
+        group.setParentItem(newgroup)
+        group = newgroup
+      elif kind == OP_LAYER:
+        h = None
+        group = QGraphicsPathItem()
+        group.setPen(noPen)
+      elif kind == OP_LAYER_END:
+        if batcher:
+          batcher.flush()
+        group.setParentItem(self)
+
+
+class BackgroundTemplate():
+  """
+  A template, shared by all the pages using it.
+  Vector templates are kept as a QSvgRenderer, so they are drawn at the
+  resolution they are painted at, and as vectors in PDFs; the others are
+  kept as a QImage.  Both can be drawn from any thread.
+  """
+
+  def __init__(self, filename):
+    self.renderer = None
+    self.image = None
+    if QSvgRenderer is not None and filename.lower().endswith('.svg'):
+      r = QSvgRenderer(filename)
+      if r.isValid():
+        app = QCoreApplication.instance()
+        if app is not None:
+          r.moveToThread(app.thread()) # may be loaded by a worker
+        self.renderer = r
+        self._lock = Lock() # renderers are not reentrant
+        # a rough estimate of the memory used by the parsed document
+        self._bytes = 4 * os.path.getsize(filename)
+    if self.renderer is None:
+      self.image = QImage(filename)
+
+  def isNull(self):
+    return self.renderer is None and self.image.isNull()
+
+  def isVector(self):
+    return self.renderer is not None
+
+  def size(self):
+    if self.renderer is not None:
+      return self.renderer.defaultSize()
+    return self.image.size()
+
+  def sizeInBytes(self):
+    if self.renderer is not None:
+      return self._bytes
+    return self.image.sizeInBytes()
+
+  def draw(self, painter, target=None):
+    # by default, at its own size at the origin of the page
+    if target is None:
+      target = QRectF(QPointF(0, 0), QSizeF(self.size()))
+    if self.renderer is not None:
+      with self._lock:
+        self.renderer.render(painter, target)
     else:
+      painter.drawImage(target, self.image)
+
+
+class BackgroundItem(QGraphicsItem):
+  """
+  Shows a BackgroundTemplate in a scene, vector templates being painted
+  at the resolution of the view.
+  """
+
+  def __init__(self, template, parent=None):
+    QGraphicsItem.__init__(self, parent)
+    self.template = template
+
+  def boundingRect(self):
+    return QRectF(QPointF(0, 0), QSizeF(self.template.size()))
+
+  def paint(self, painter, option, widget=None):
+    self.template.draw(painter)
+
+
+_templateCache = None
+def templateCache(max_size=32 * 2**20):
+  # templates shared by the previews, thumbnails and exports,
+  # evicted by their size in bytes
+  global _templateCache
+  if _templateCache is None:
+    _templateCache = LRUCache(max_size, sizeof=lambda t: t.sizeInBytes())
+  return _templateCache
+
+def backgroundTemplate(bg):
+  # the BackgroundTemplate of the page background bg, None if unavailable
+  if not bg or bg.name == "Blank":
+    return None
+  cache = templateCache()
+  t = cache.get(bg.name)
+  if t is None:
+    bgf = bg.retrieve(preferVector=QSvgRenderer is not None)
+    if not bgf:
+      return None
+    t = BackgroundTemplate(bgf)
+    if t.isNull():
       return None
-  return _TEMPLATE_CACHE[bg.name]
+    cache.put(bg.name, t)
+  return t
 
 def BarePageScene(page, parent=None, include_base_layer=True, orientation=None, **kw):
   scene = QGraphicsScene(parent=parent)
   r = scene.addRect(0,0,rm.WIDTH, rm.HEIGHT)
   r.setFlag(QGraphicsItem.ItemClipsChildrenToShape)
-  if page.background and page.background.name != "Blank" and include_base_layer:
-    img = pixmapOfBackground(page.background)
-    if img:
-      QGraphicsPixmapItem(img, r)
+  if include_base_layer:
+    bg = backgroundTemplate(page.background)
+    if bg:
+      # referenced, or the Python side of the item would be collected
+      scene.backgroundItem = BackgroundItem(bg, r)
   PageGraphicsItem(page, parent=r, **kw)
   scene.setSceneRect(r.rect())
   return scene
@@ -422,3 +813,109 @@ def BarePageScene(page, parent=None, include_base_layer=True, orientation=None,
 # so you need to do as much as possible in the worker thread, get a signal with the pagescene
 # and a QImage of the background (maybe), then in main thread you add the PixmapItem to the scene
 
+
+class PagePainter():
+  """
+  Paints a page straight onto a QPainter, with the same result as
+  rendering a BarePageScene, but without building a scene.
+  The drawing operations are prepared on construction, and can be
+  painted any number of times with `render`, which takes the same
+  arguments as `QGraphicsScene.render`, so a PagePainter can stand in
+  for a scene that is only rendered.
+  It only uses images, so it can be used in worker threads
+  (e.g. painting onto a QImage).
+  """
+
+  def __init__(self, page, include_base_layer=True, orientation=None, **kw):
+    # see pageOps for the options
+    self.background = backgroundTemplate(page.background) if include_base_layer else None
+    self.layers = []
+    for op in pageOps(page, **kw):
+      kind = op[0]
+      if kind == OP_PATH:
+        _, path, pen, _, darken, z = op
+        w = pen.widthF() / 2
+        bounds = path.controlPointRect().adjusted(-w, -w, w, w)
+        group[1 if z < 0 else 2].append((path, QPen(pen), darken, bounds))
+      elif kind == OP_HIGHLIGHT:
+        highlights.append(op[1:3])
+      elif kind == OP_ERASE:
+        # clip the strokes so far, which become the bottom of a new group
+        group[0] = op[1]
+        group = [None, [], [group]]
+      elif kind == OP_LAYER:
+        # groups are [clip, paths below, paths and nested groups above]
+        highlights = []
+        group = [None, [], []]
+      elif kind == OP_LAYER_END:
+        self.layers.append((highlights, group))
+
+  def sceneRect(self):
+    return QRectF(0, 0, rm.WIDTH, rm.HEIGHT)
+
+  def width(self):
+    return rm.WIDTH
+
+  def height(self):
+    return rm.HEIGHT
+
+  def render(self, painter, target=QRectF(), source=QRectF(), mode=Qt.KeepAspectRatio):
+    if source.isNull():
+      source = self.sceneRect()
+    if target.isNull():
+      d = painter.device()
+      target = QRectF(0, 0, d.width(), d.height())
+    sx = target.width() / source.width()
+    sy = target.height() / source.height()
+    if mode == Qt.KeepAspectRatio:
+      sx = sy = min(sx, sy)
+    elif mode == Qt.KeepAspectRatioByExpanding:
+      sx = sy = max(sx, sy)
+
+    painter.save()
+    try:
+      painter.setClipRect(target, Qt.IntersectClip)
+      painter.translate(target.x(), target.y())
+      painter.scale(sx, sy)
+      painter.translate(-source.x(), -source.y())
+      page = self.sceneRect()
+      # the outline drawn by the page rect of BarePageScene
+      painter.setPen(QPen())
+      painter.setBrush(Qt.NoBrush)
+      painter.drawRect(page)
+      painter.setClipRect(page, Qt.IntersectClip)
+      if self.background:
+        self.background.draw(painter)
+      painter.setPen(Qt.NoPen)
+      for highlights, group in self.layers:
+        if highlights:
+          painter.setCompositionMode(QPainter.CompositionMode_Darken)
+          for rect, color in highlights:
+            painter.fillRect(rect, color)
+          painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+        self._paintGroup(painter, group, source)
+    finally:
+      painter.restore()
+
+  def _paintGroup(self, painter, group, area):
+    # only the paths intersecting area are painted
+    clip, below, above = group
+    if clip is not None:
+      painter.save()
+      painter.setClipPath(clip, Qt.IntersectClip)
+    for g in (below, above):
+      for x in g:
+        if isinstance(x, list):
+          self._paintGroup(painter, x, area)
+          continue
+        path, pen, darken, bounds = x
+        if not bounds.intersects(area):
+          continue
+        if darken:
+          painter.setCompositionMode(QPainter.CompositionMode_Darken)
+        painter.setPen(pen)
+        painter.drawPath(path)
+        if darken:
+          painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+    if clip is not None:
+      painter.restore()
@@ -1,4 +1,6 @@
 import logging
+from collections import OrderedDict
+from threading import RLock
 
 logging.basicConfig(format='[%(levelname).1s] %(message)s')
 
@@ -21,3 +23,72 @@ def deepupdate(d, u):
           stack.append((d[k], v))
   return d
 
+
+
+class LRUCache():
+  """
+  Thread-safe mapping which evicts the least recently used entries
+  once the total size of its values goes over `max_size`.
+  The size of each value is given by `sizeof` (by default every value
+  counts as 1, making `max_size` a number of entries).
+  """
+
+  def __init__(self, max_size, sizeof=None):
+    self.max_size = max_size
+    self._sizeof = sizeof or (lambda v: 1)
+    self._data = OrderedDict() # key -> (value, size)
+    self._size = 0
+    self._lock = RLock()
+
+  def get(self, key, default=None):
+    with self._lock:
+      if key not in self._data:
+        return default
+      self._data.move_to_end(key)
+      return self._data[key][0]
+
+  def put(self, key, value, size=None):
+    if size is None:
+      size = self._sizeof(value)
+    with self._lock:
+      self.pop(key)
+      if size > self.max_size:
+        return
+      self._data[key] = (value, size)
+      self._size += size
+      while self._size > self.max_size:
+        _, (_, s) = self._data.popitem(last=False)
+        self._size -= s
+
+  def pop(self, key, default=None):
+    with self._lock:
+      if key not in self._data:
+        return default
+      value, size = self._data.pop(key)
+      self._size -= size
+      return value
+
+  def discard(self, pred):
+    with self._lock:
+      for key in [k for k in self._data if pred(k)]:
+        self.pop(key)
+
+  def clear(self):
+    with self._lock:
+      self._data.clear()
+      self._size = 0
+
+  def size(self):
+    return self._size
+
+  def __contains__(self, key):
+    return key in self._data
+
+  def __getitem__(self, key):
+    with self._lock:
+      if key not in self._data:
+        raise KeyError(key)
+      return self.get(key)
+
+  def __len__(self):
+    return len(self._data)
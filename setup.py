@@ -45,8 +45,9 @@ setup(
   python_requires=">=3.8",
   install_requires=['pyqt5', 'requests', 'sip', 'arrow', 'paramiko', 'PyPDF2<=1.28.4'],
   extras_require={
-    'default': ['pymupdf'],
+    'default': ['pymupdf', 'numpy'],
     'simpl': ['simplification'],
+    'numpy': ['numpy'],
     'mupdf': ['pymupdf'],
     'poppler': ['python-poppler-qt5']
   },